@@ -0,0 +1,94 @@
+"""
+Serialization / compression benchmark for a sales-history sized payload.
+
+    python bench_serialization.py [--rows 5000] [--seconds 3]
+
+Compares FastAPI's default path (jsonable_encoder + JSONResponse) with
+FastJSONResponse, then end-to-end requests through BrotliMiddleware with
+identity, gzip and brotli encodings. Needs no database.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from brotli_asgi import BrotliMiddleware
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from fast_json import FastJSONResponse
+
+
+def make_sales(n: int) -> dict:
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1)
+    sales = []
+    for _ in range(n):
+        buy = round(rng.uniform(5, 500), 2)
+        sell = round(buy * rng.uniform(0.7, 1.5), 2)
+        qty = float(rng.randint(1, 200))
+        sales.append(
+            {
+                "id": str(ObjectId()),
+                "symbol": rng.choice(["AAPL", "MSFT", "NVDA", "TSLA", "BRK.B"]),
+                "qty": qty,
+                "buy_price": buy,
+                "sell_price": sell,
+                "profit": (sell - buy) * qty,
+                "timestamp": start + timedelta(minutes=rng.randint(0, 2_000_000)),
+            }
+        )
+    return {"sales": sales, "next_cursor": None}
+
+
+def rate(fn, seconds: float) -> float:
+    """Calls per second of `fn` over roughly `seconds`."""
+    fn()  # warm-up
+    calls = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        fn()
+        calls += 1
+    return calls / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+    payload = make_sales(args.rows)
+
+    print(f"Encoding {args.rows} sales")
+    default = rate(lambda: JSONResponse(jsonable_encoder(payload)), args.seconds)
+    fast = rate(lambda: FastJSONResponse(payload), args.seconds)
+    print(f"  default JSONResponse   {default:8.1f} responses/s")
+    print(f"  FastJSONResponse       {fast:8.1f} responses/s  ({fast / default:.1f}x)")
+
+    app = FastAPI(default_response_class=FastJSONResponse)
+    app.add_middleware(BrotliMiddleware, quality=4, minimum_size=1000)
+
+    @app.get("/default", response_class=JSONResponse)
+    def default_route():
+        return payload
+
+    @app.get("/fast")
+    def fast_route():
+        return FastJSONResponse(payload)
+
+    client = TestClient(app)
+    print("End to end (TestClient)")
+    for route in ("/default", "/fast"):
+        for encoding in ("identity", "gzip", "br"):
+            headers = {"Accept-Encoding": encoding}
+            resp = client.get(route, headers=headers)
+            size = int(resp.headers.get("content-length", len(resp.content)))
+            rps = rate(lambda: client.get(route, headers=headers), args.seconds)
+            print(f"  {route:9} {encoding:9} {rps:8.1f} req/s  {size / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
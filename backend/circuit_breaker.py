@@ -0,0 +1,106 @@
+import random
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker for one upstream dependency.
+    - closed: calls flow; `failure_threshold` consecutive failures open it.
+    - open: calls are refused until the cool-down ends. The cool-down is
+      the upstream's Retry-After if it sent one, otherwise a jittered
+      exponential backoff that doubles each time the breaker re-opens.
+    - half_open: one probe call is let through; success closes the breaker,
+      failure re-opens it with a longer cool-down.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        base_cooldown: float = 15,
+        max_cooldown: float = 600,
+    ):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opens = 0  # consecutive re-opens, drives the backoff
+        self._open_until = 0.0
+        self._probe_in_flight = False
+        self._rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. Call record_* afterwards if so."""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() < self._open_until:
+                    self._rejected += 1
+                    return False
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self._rejected += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def cancel(self):
+        """An allowed call never went out (e.g. throttled locally)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                print("🟢 Circuit closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._opens = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, retry_after: float | None = None):
+        """
+        Count a failure. A Retry-After from the upstream (e.g. on 429) opens
+        the breaker immediately for at least that long.
+        """
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            should_open = (
+                self._state == HALF_OPEN
+                or retry_after is not None
+                or self._failures >= self.failure_threshold
+            )
+            if not should_open:
+                return
+            backoff = min(self.base_cooldown * 2**self._opens, self.max_cooldown)
+            cooldown = backoff * random.uniform(0.5, 1.0)
+            if retry_after is not None:
+                cooldown = max(cooldown, retry_after)
+            self._opens += 1
+            self._state = OPEN
+            self._open_until = time.monotonic() + cooldown
+            print(f"🔴 Circuit open for {cooldown:.0f}s")
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._open_until:
+                return HALF_OPEN
+            return self._state
+
+    def stats(self) -> dict:
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "retry_in": max(0.0, round(self._open_until - time.monotonic(), 1)),
+                "rejected": self._rejected,
+            }
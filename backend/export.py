@@ -0,0 +1,165 @@
+import csv
+import io
+import json
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+
+# Rows are buffered into chunks of about this size before being sent
+CHUNK_BYTES = 64 * 1024
+# Rows per Arrow record batch / Parquet row group
+BATCH_ROWS = 10_000
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+# format -> (media type, file extension)
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "arrow": (ARROW_MEDIA_TYPE, "arrow"),
+    "parquet": (PARQUET_MEDIA_TYPE, "parquet"),
+}
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def ndjson_chunks(rows: Iterable[dict]) -> Iterator[bytes]:
+    """One JSON object per line."""
+    buf: list[str] = []
+    size = 0
+    for row in rows:
+        line = json.dumps({k: _plain(v) for k, v in row.items()}, default=str)
+        buf.append(line + "\n")
+        size += len(line) + 1
+        if size >= CHUNK_BYTES:
+            yield "".join(buf).encode()
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf).encode()
+
+
+def csv_chunks(rows: Iterable[dict], columns: dict[str, str]) -> Iterator[bytes]:
+    """Header row followed by one line per row, in `columns` order."""
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(columns), extrasaction="ignore")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({k: _plain(v) for k, v in row.items()})
+        if out.tell() >= CHUNK_BYTES:
+            yield out.getvalue().encode()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue().encode()
+
+
+# ---------- Arrow / Parquet (columnar) ----------
+def arrow_schema(columns: dict[str, str], metadata: dict | None = None):
+    """
+    `columns` maps column name -> "string", "float64", "bool" or "timestamp";
+    `metadata` values (e.g. a page cursor) travel as schema metadata.
+    """
+    import pyarrow as pa
+
+    types = {
+        "string": pa.string(),
+        "float64": pa.float64(),
+        "bool": pa.bool_(),
+        "timestamp": pa.timestamp("ms"),
+    }
+    return pa.schema(
+        [(name, types[kind]) for name, kind in columns.items()],
+        metadata={k: json.dumps(v) for k, v in (metadata or {}).items()},
+    )
+
+
+def _record_batches(rows: Iterable[dict], schema) -> Iterator:
+    """Pivot rows into columns, BATCH_ROWS at a time."""
+    import pyarrow as pa
+
+    names = schema.names
+    cols: dict[str, list] = {n: [] for n in names}
+    count = 0
+    for row in rows:
+        for n in names:
+            cols[n].append(row.get(n))
+        count += 1
+        if count == BATCH_ROWS:
+            yield pa.RecordBatch.from_pydict(cols, schema=schema)
+            cols, count = {n: [] for n in names}, 0
+    if count:
+        yield pa.RecordBatch.from_pydict(cols, schema=schema)
+
+
+class _ChunkSink:
+    """File-like sink that hands back whatever was written since last take()."""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        out = b"".join(self._chunks)
+        self._chunks = []
+        return out
+
+
+def columnar_chunks(
+    rows: Iterable[dict],
+    fmt: str,
+    columns: dict[str, str],
+    metadata: dict | None = None,
+) -> Iterator[bytes]:
+    """
+    Arrow IPC stream or Parquet file, written one record batch / row group
+    at a time so only BATCH_ROWS rows are ever held in memory.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(columns, metadata)
+    sink = _ChunkSink()
+    if fmt == "arrow":
+        writer = pa.ipc.new_stream(sink, schema)
+    else:
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    for batch in _record_batches(rows, schema):
+        writer.write_batch(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def columnar_bytes(
+    rows: Iterable[dict],
+    fmt: str,
+    columns: dict[str, str],
+    metadata: dict | None = None,
+) -> bytes:
+    """A whole (small) result in one piece, e.g. one API page."""
+    return b"".join(columnar_chunks(rows, fmt, columns, metadata))
+
+
+def export_chunks(
+    rows: Iterable[dict], fmt: str, columns: dict[str, str]
+) -> Iterator[bytes]:
+    """
+    Encode `rows` lazily, so memory stays flat however many rows the
+    underlying cursor yields. Raises ValueError for an unknown format.
+    """
+    if fmt == "ndjson":
+        return ndjson_chunks(rows)
+    if fmt == "csv":
+        return csv_chunks(rows, columns)
+    if fmt in ("arrow", "parquet"):
+        return columnar_chunks(rows, fmt, columns)
+    raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
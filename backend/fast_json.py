@@ -0,0 +1,26 @@
+import orjson
+from bson import ObjectId
+from fastapi.responses import ORJSONResponse
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class FastJSONResponse(ORJSONResponse):
+    """
+    orjson-encoded JSON, used as the app's default response class.
+    datetimes are serialized natively as ISO-8601 (naive values stay naive,
+    i.e. the same strings FastAPI's encoder produced), ObjectIds as strings.
+    Endpoints that return one directly also skip FastAPI's jsonable_encoder
+    pass, which is most of the cost on large payloads.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(
+            content,
+            default=_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        )
@@ -0,0 +1,49 @@
+import importlib.util
+
+import httpx
+
+USER_AGENT = "Mozilla/5.0 (FinanceDashboardBot/1.0)"
+
+
+def http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package (httpx[http2])."""
+    return importlib.util.find_spec("h2") is not None
+
+
+def _limits(max_connections: int, max_keepalive: int) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=30,
+    )
+
+
+def make_provider_client(max_connections: int, max_keepalive: int) -> httpx.Client:
+    """
+    Pooled client for market-data providers.
+    Synchronous because provider calls run on the refresher / prefetch worker
+    threads; httpx.Client is thread-safe and reuses connections across them.
+    """
+    return httpx.Client(
+        http2=http2_available(),
+        limits=_limits(max_connections, max_keepalive),
+        timeout=httpx.Timeout(10, connect=3),
+        headers={"User-Agent": USER_AGENT},
+    )
+
+
+def make_scraper_client(
+    max_connections: int, max_keepalive: int
+) -> httpx.AsyncClient:
+    """
+    Pooled async client for the Collectr scraper endpoint.
+    Kept separate from the provider pool so slow third-party pages can never
+    use up the connections price refreshes need (and vice versa).
+    """
+    return httpx.AsyncClient(
+        http2=http2_available(),
+        limits=_limits(max_connections, max_keepalive),
+        timeout=httpx.Timeout(10, connect=3),
+        headers={"User-Agent": "Mozilla/5.0"},
+        follow_redirects=True,
+    )
@@ -0,0 +1,101 @@
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class MongoLease:
+    """
+    Cluster-wide lease stored as one document per lease name:
+        {"_id": name, "holder": "<host>:<pid>:<id>", "expires_at": datetime}
+    A heartbeat thread renews it every `heartbeat_seconds`. If the holder
+    dies, the lease lapses after `ttl_seconds` and the next heartbeat from
+    any other process takes it over. A TTL index also lets Mongo delete
+    abandoned lease documents.
+    """
+
+    def __init__(
+        self,
+        collection,
+        name: str,
+        ttl_seconds: float = 30,
+        heartbeat_seconds: float = 10,
+    ):
+        self.col = collection
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._leader = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.col.create_index("expires_at", expireAfterSeconds=0)
+
+    def try_acquire(self) -> bool:
+        """Take or renew the lease. Returns True if we hold it afterwards."""
+        now = datetime.utcnow()
+        try:
+            doc = self.col.find_one_and_update(
+                {
+                    "_id": self.name,
+                    "$or": [{"holder": self.holder}, {"expires_at": {"$lt": now}}],
+                },
+                {
+                    "$set": {
+                        "holder": self.holder,
+                        "expires_at": now + timedelta(seconds=self.ttl_seconds),
+                    }
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            held = doc is not None and doc.get("holder") == self.holder
+        except DuplicateKeyError:
+            # Lease exists and is held by someone else
+            held = False
+
+        if held and not self._leader.is_set():
+            print(f"👑 Acquired lease '{self.name}' as {self.holder}")
+        elif not held and self._leader.is_set():
+            print(f"⚠️ Lost lease '{self.name}'")
+        if held:
+            self._leader.set()
+        else:
+            self._leader.clear()
+        return held
+
+    def release(self):
+        """Give the lease up so another process can take over immediately."""
+        self._stop.set()
+        if self._leader.is_set():
+            self.col.delete_one({"_id": self.name, "holder": self.holder})
+            self._leader.clear()
+            print(f"👋 Released lease '{self.name}'")
+
+    def is_leader(self) -> bool:
+        return self._leader.is_set()
+
+    def wait_for_leadership(self, timeout: float | None = None) -> bool:
+        return self._leader.wait(timeout)
+
+    def _heartbeat(self):
+        while not self._stop.is_set():
+            try:
+                self.try_acquire()
+            except Exception as e:
+                print(f"❌ Lease heartbeat error for '{self.name}': {e}")
+                self._leader.clear()
+            self._stop.wait(self.heartbeat_seconds)
+
+    def start(self):
+        """Start the heartbeat thread (idempotent)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+            self._thread.start()
+
+    def stats(self) -> dict:
+        return {"name": self.name, "holder": self.holder, "leader": self.is_leader()}
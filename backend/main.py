@@ -1,16 +1,41 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from pymongo import MongoClient, ASCENDING
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReplaceOne, ReturnDocument
 from bson import ObjectId
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import date, datetime, timedelta
+import base64
+import hashlib
 import os
+import re
 import time
 import threading
-import requests
 import bcrypt
+import httpx
 from bs4 import BeautifulSoup
+from brotli_asgi import BrotliMiddleware
+
+from export import (
+    ARROW_MEDIA_TYPE,
+    EXPORT_FORMATS,
+    PARQUET_MEDIA_TYPE,
+    columnar_bytes,
+    export_chunks,
+)
+from fast_json import FastJSONResponse
+from http_clients import make_provider_client, make_scraper_client
+from leader_lease import MongoLease
+from market_calendar import ExchangeCalendar
+from prefetch import PrefetchQueue
+from price_cache import PriceCache
+from price_history import PriceHistory
+from providers import LocalProvider, ProviderChain, TwelveDataProvider, YFinanceProvider
+from rate_limiter import PRIORITY_BACKGROUND, PRIORITY_USER
+from refresh_scheduler import RefreshScheduler
+from singleflight import SingleFlight
 
 # =========================
 # Setup & configuration
@@ -20,8 +45,40 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongo:27017/")
 DB_NAME = os.getenv("DB_NAME", "finance")
 TWELVEDATA_API_KEY = os.getenv("TWELVEDATA_API_KEY", "").strip()
+# Fallback freshness for prices cached without a market-aware TTL
 PRICE_TTL_SECONDS = 3600  # 1 hour
-RATE_LIMIT_CALLS_PER_MIN = 8
+# While the exchange is open prices expire after MARKET_OPEN_TTL_SECONDS (and
+# by MARKET_SETTLE_SECONDS after the close); outside trading hours they stay
+# fresh until the next open, so quota isn't spent overnight or on weekends
+MARKET_OPEN_TTL_SECONDS = int(os.getenv("MARKET_OPEN_TTL_SECONDS", "900"))
+MARKET_SETTLE_SECONDS = int(os.getenv("MARKET_SETTLE_SECONDS", "900"))
+MARKET_CALENDAR_FILE = os.getenv("MARKET_CALENDAR_FILE") or None
+RATE_LIMIT_CALLS_PER_MIN = 8  # API credits per minute; one credit per symbol
+# Symbols per /price request; raise on paid plans with bigger per-minute credits
+TWELVEDATA_BATCH_SIZE = int(os.getenv("TWELVEDATA_BATCH_SIZE", "8"))
+# Ordered fallback chain, e.g. "twelvedata,yfinance"; "local" is an offline
+# deterministic random walk for load tests
+PRICE_PROVIDERS = [
+    p.strip().lower()
+    for p in os.getenv("PRICE_PROVIDERS", "twelvedata").split(",")
+    if p.strip()
+]
+LOCAL_PROVIDER_SEED = int(os.getenv("LOCAL_PROVIDER_SEED", "0"))
+LOCAL_PROVIDER_FILE = os.getenv("LOCAL_PROVIDER_FILE") or None
+# Connection pools for outbound HTTP (providers and scraper are separate)
+PROVIDER_HTTP_MAX_CONNECTIONS = int(os.getenv("PROVIDER_HTTP_MAX_CONNECTIONS", "10"))
+PROVIDER_HTTP_MAX_KEEPALIVE = int(os.getenv("PROVIDER_HTTP_MAX_KEEPALIVE", "5"))
+SCRAPER_HTTP_MAX_CONNECTIONS = int(os.getenv("SCRAPER_HTTP_MAX_CONNECTIONS", "20"))
+SCRAPER_HTTP_MAX_KEEPALIVE = int(os.getenv("SCRAPER_HTTP_MAX_KEEPALIVE", "10"))
+PRICE_CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", "5000"))
+# How long past its TTL a price may still be served (flagged stale)
+PRICE_STALE_MAX_SECONDS = int(os.getenv("PRICE_STALE_MAX_SECONDS", str(7 * 86400)))
+# Backoff for symbols the provider can't price: 5 min, doubling, capped at 1 day
+PRICE_RETRY_BASE_SECONDS = 300
+PRICE_RETRY_MAX_SECONDS = 86400
+UNPRICEABLE_AFTER_FAILURES = 3
+# Responses smaller than this go out uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1000"))
 
 # Mongo client / DB
 client = MongoClient(MONGO_URI)
@@ -32,13 +89,32 @@ users_col = db["users"]
 holdings_col = db["holdings"]
 realized_col = db["realized_gains"]
 prices_cache_col = db["prices_cache"]
+leases_col = db["leases"]
+symbols_col = db["symbols"]
+portfolio_stats_col = db["portfolio_stats"]
 
 # Indexes
 holdings_col.create_index([("symbol", ASCENDING), ("user_id", ASCENDING)], unique=True)
+holdings_col.create_index([("user_id", ASCENDING), ("qty", ASCENDING)])
+# Sales history: newest-first keyset pages, optionally for one symbol
+realized_col.create_index(
+    [("user_id", ASCENDING), ("ts", DESCENDING), ("_id", DESCENDING)]
+)
+realized_col.create_index(
+    [
+        ("user_id", ASCENDING),
+        ("symbol", ASCENDING),
+        ("ts", DESCENDING),
+        ("_id", DESCENDING),
+    ]
+)
 prices_cache_col.create_index([("symbol", ASCENDING)], unique=True)
+symbols_col.create_index("refresh_requested_at", sparse=True)
 
 # CORS (Streamlit -> FastAPI)
-app = FastAPI(title="Personal Finance Dashboard API")
+app = FastAPI(
+    title="Personal Finance Dashboard API", default_response_class=FastJSONResponse
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -46,9 +122,41 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Brotli when the client accepts it, gzip otherwise
+app.add_middleware(
+    BrotliMiddleware, quality=4, minimum_size=COMPRESS_MIN_BYTES, gzip_fallback=True
+)
 
-# In-memory cache: { "AAPL": {"price": 123.45, "time": 1710000000.0} }
-mem_price_cache: dict[str, dict[str, float]] = {}
+# Symbols served stale and waiting for the refresher
+refresh_queue: set[str] = set()
+refresh_queue_lock = threading.Lock()
+refresh_wakeup = threading.Event()
+
+
+def queue_price_refresh(symbols: list[str]):
+    with refresh_queue_lock:
+        refresh_queue.update(symbols)
+    refresh_wakeup.set()
+
+
+# Trading sessions; decide how long a fetched price stays fresh
+market_calendar = ExchangeCalendar(
+    MARKET_CALENDAR_FILE,
+    open_ttl=MARKET_OPEN_TTL_SECONDS,
+    settle_seconds=MARKET_SETTLE_SECONDS,
+)
+
+# Tiered price cache: bounded in-process LRU backed by prices_cache_col
+price_cache = PriceCache(
+    prices_cache_col,
+    ttl_seconds=PRICE_TTL_SECONDS,
+    max_entries=PRICE_CACHE_MAX_ENTRIES,
+    stale_seconds=PRICE_STALE_MAX_SECONDS,
+    on_stale=queue_price_refresh,
+    retry_base_seconds=PRICE_RETRY_BASE_SECONDS,
+    retry_max_seconds=PRICE_RETRY_MAX_SECONDS,
+    unpriceable_after=UNPRICEABLE_AFTER_FAILURES,
+)
 
 
 # =========================
@@ -61,102 +169,455 @@ def _objid(s: str) -> ObjectId:
         raise HTTPException(status_code=400, detail="Invalid user_id")
 
 
-def _now() -> float:
-    return time.time()
+def _accept_weights(accept: str) -> dict[str, float]:
+    """Media type -> q-value for each entry of an Accept header."""
+    weights = {}
+    for entry in accept.split(","):
+        media_type, *params = (part.strip() for part in entry.split(";"))
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[media_type.lower()] = q
+    return weights
+
+
+def _columnar_format(request: Request) -> str | None:
+    """
+    "arrow" / "parquet" if the client's Accept header names it with q > 0
+    and weights it at least as high as JSON (directly or via a wildcard).
+    """
+    weights = _accept_weights(request.headers.get("accept", ""))
+    json_q = weights.get(
+        "application/json", weights.get("application/*", weights.get("*/*", 0.0))
+    )
+    fmt, best_q = None, 0.0
+    for media_type, name in (
+        (ARROW_MEDIA_TYPE, "arrow"),
+        (PARQUET_MEDIA_TYPE, "parquet"),
+    ):
+        q = weights.get(media_type, 0.0)
+        if q > best_q:
+            fmt, best_q = name, q
+    return fmt if fmt and best_q >= json_q else None
+
+
+def _columnar_response(
+    rows, fmt: str, columns: dict[str, str], metadata: dict, headers: dict
+):
+    """Rows as one Arrow IPC stream / Parquet file; extras go in schema metadata."""
+    return Response(
+        content=columnar_bytes(rows, fmt, columns, metadata),
+        media_type=EXPORT_FORMATS[fmt][0],
+        headers=headers,
+    )
 
 
-def _get_mem_price(symbol: str):
-    e = mem_price_cache.get(symbol)
-    if e and _now() - e["time"] < PRICE_TTL_SECONDS:
-        return e["price"]
-    return None
+# =========================
+# Price Fetching
+# =========================
+# Shared keep-alive pool for provider calls (thread-safe, used by workers)
+provider_http = make_provider_client(
+    PROVIDER_HTTP_MAX_CONNECTIONS, PROVIDER_HTTP_MAX_KEEPALIVE
+)
+# Async pool for the scraper endpoint; opened/closed with the app lifecycle
+scraper_http: httpx.AsyncClient | None = None
+
+
+def _build_providers() -> ProviderChain:
+    """Build the fallback chain named by PRICE_PROVIDERS (in order)."""
+    providers = []
+    for name in PRICE_PROVIDERS:
+        if name == "twelvedata":
+            providers.append(
+                TwelveDataProvider(
+                    TWELVEDATA_API_KEY,
+                    rate_per_min=RATE_LIMIT_CALLS_PER_MIN,
+                    max_batch=TWELVEDATA_BATCH_SIZE,
+                    http=provider_http,
+                )
+            )
+        elif name == "yfinance":
+            providers.append(YFinanceProvider())
+        elif name == "local":
+            providers.append(
+                LocalProvider(seed=LOCAL_PROVIDER_SEED, path=LOCAL_PROVIDER_FILE)
+            )
+        else:
+            print(f"⚠️ Unknown price provider '{name}', skipping")
+    print(f"📡 Price providers: {' → '.join(p.name for p in providers)}")
+    return ProviderChain(providers)
 
 
-def _set_mem_price(symbol: str, price: float):
-    mem_price_cache[symbol] = {"price": price, "time": _now()}
+# Every fetched quote is also kept as history (ticks + OHLC rollups)
+price_history = PriceHistory(db)
 
+# Every outbound price call goes through this chain and its rate limiters
+price_providers = _build_providers()
 
-def _get_db_price(symbol: str):
-    doc = prices_cache_col.find_one({"symbol": symbol})
-    if not doc:
-        return None
-    ts = float(doc.get("updated_at", 0))
-    if _now() - ts < PRICE_TTL_SECONDS:
-        return float(doc["price"])
-    return None
+
+# Concurrent fetches of the same symbol share one outbound request
+price_flight = SingleFlight()
+
+
+def fetch_prices(
+    symbols: list[str], priority: int = PRIORITY_USER
+) -> dict[str, float]:
+    """
+    Unified batch fetcher over the provider chain.
+    Symbols backing off after failed fetches are skipped. Symbols already
+    being fetched by another caller are awaited rather than requested again.
+    """
+    symbols = [s.upper() for s in symbols]
+    symbols = [s for s in symbols if price_cache.retry_at(s) is None]
+    return price_flight.do_many(
+        symbols, lambda mine: _fetch_and_cache(mine, priority)
+    )
+
+
+def fetch_price(symbol: str, priority: int = PRIORITY_USER) -> float | None:
+    return fetch_prices([symbol], priority).get(symbol.upper())
 
 
-def _set_db_price(symbol: str, price: float):
-    prices_cache_col.update_one(
-        {"symbol": symbol},
-        {"$set": {"symbol": symbol, "price": float(price), "updated_at": _now()}},
+def _fetch_and_cache(symbols: list[str], priority: int) -> dict[str, float]:
+    # Symbols no provider could reach are left to the normal retry path;
+    # only ones a provider answered for without a price count as failures
+    prices, rejected = price_providers.fetch(symbols, priority)
+    ttl = market_calendar.ttl()
+    for sym, p in prices.items():
+        price_cache.set(sym, p, ttl=ttl)
+    try:
+        price_history.record(prices)
+    except Exception as e:
+        print(f"⚠️ Could not record price history: {e}")
+    if rejected:
+        print(f"🚫 No valid price found for {', '.join(rejected)}")
+        price_cache.mark_failed(rejected)
+    return prices
+
+
+# Symbols users just added, fetched off the request path in small batches
+prefetch_queue = PrefetchQueue(
+    lambda symbols: fetch_prices(symbols, PRIORITY_USER),
+    batch_size=price_providers.batch_size,
+)
+
+
+# =========================
+# Symbol registry
+# =========================
+# symbols_col holds one doc per held symbol:
+#   {"_id": "AAPL", "holders": 3, "qty": 120.0, "cost": 18000.0}
+# kept current by the holding endpoints, so the refresher never has to scan
+# holdings_col. Workers that don't hold the refresher lease also set
+# "refresh_requested_at" on it to hand stale symbols to the leader.
+def registry_update(
+    symbol: str,
+    old: tuple[float, float] | None,
+    new: tuple[float, float] | None,
+):
+    """
+    Apply one user's holding change to the registry.
+    `old` / `new` are that holding's (qty, price) before and after the write,
+    None if it did not / no longer exists.
+    """
+    old_qty, old_price = old or (0.0, 0.0)
+    new_qty, new_price = new or (0.0, 0.0)
+    holders = int(new_qty > 0) - int(old_qty > 0)
+    qty = new_qty - old_qty
+    cost = new_qty * new_price - old_qty * old_price
+    if not (holders or qty or cost):
+        return
+
+    doc = symbols_col.find_one_and_update(
+        {"_id": symbol},
+        {"$inc": {"holders": holders, "qty": qty, "cost": cost}},
         upsert=True,
+        return_document=ReturnDocument.AFTER,
     )
+    if doc["holders"] <= 0:
+        result = symbols_col.delete_one({"_id": symbol, "holders": {"$lte": 0}})
+        if result.deleted_count:
+            print(f"🧹 Nobody holds {symbol} anymore — dropping it from the cache")
+            price_cache.discard(symbol)
+
+
+def rebuild_symbol_registry() -> int:
+    """Recompute symbols_col from holdings (migration / repair)."""
+    rows = holdings_col.aggregate(
+        [
+            {"$match": {"qty": {"$gt": 0}}},
+            {
+                "$group": {
+                    "_id": {"$toUpper": "$symbol"},
+                    "holders": {"$sum": 1},
+                    "qty": {"$sum": "$qty"},
+                    "cost": {"$sum": {"$multiply": ["$qty", "$price"]}},
+                }
+            },
+        ]
+    )
+    rows = list(rows)
+    if rows:
+        symbols_col.bulk_write(
+            [ReplaceOne({"_id": r["_id"]}, r, upsert=True) for r in rows],
+            ordered=False,
+        )
+    symbols_col.delete_many({"_id": {"$nin": [r["_id"] for r in rows]}})
+    print(f"📇 Symbol registry rebuilt with {len(rows)} symbols")
+    return len(rows)
 
 
 # =========================
-# Price Fetching
+# Portfolio stats
 # =========================
-def fetch_price_from_twelvedata(symbol: str) -> float | None:
-    """Fetch latest stock price using Twelve Data API (free-tier friendly)."""
-    api_key = TWELVEDATA_API_KEY
-    if not api_key:
-        print("⚠️ No Twelve Data API key configured.")
-        return None
+# portfolio_stats_col holds one doc per user with at least one sale:
+#   {"_id": user_id, "realized": 1234.5, "sales": 17,
+#    "by_year": {"2025": 1000.0}, "by_symbol": {"AAPL": 234.5}}
+# kept current by the sale endpoints, so nothing re-sums realized_col.
+def _stats_key(symbol: str) -> str:
+    # Field names can't contain "." (e.g. BRK.B); use a full-width dot
+    return symbol.replace(".", "\uff0e")
+
+
+def stats_record_sale(uid: ObjectId, sale: dict, sign: int = 1):
+    """Add (sign=1) or remove (sign=-1) one sale with a single atomic $inc."""
+    profit = sign * float(sale.get("profit", 0))
+    year = str(sale["ts"].year) if sale.get("ts") else "unknown"
+    portfolio_stats_col.update_one(
+        {"_id": uid},
+        {
+            "$inc": {
+                "realized": profit,
+                "sales": sign,
+                f"by_year.{year}": profit,
+                f"by_symbol.{_stats_key(sale.get('symbol') or '')}": profit,
+            }
+        },
+        upsert=True,
+    )
 
-    url = f"https://api.twelvedata.com/price?symbol={symbol.upper()}&apikey={api_key}"
-    headers = {"User-Agent": "Mozilla/5.0 (FinanceDashboardBot/1.0)"}
 
-    try:
-        r = requests.get(url, headers=headers, timeout=10)
-        if r.status_code != 200:
-            print(f"⚠️ Twelve Data returned {r.status_code} for {symbol}")
-            return None
-        data = r.json()
-        if "price" in data and data["price"] is not None:
-            price = float(data["price"])
-            print(f"✅ Twelve Data: {symbol} @ {price}")
-            return price
-        print(f"⚠️ Twelve Data: unexpected response for {symbol}: {data}")
-    except Exception as e:
-        print(f"❌ Twelve Data fetch failed for {symbol}: {e}")
-    return None
+def get_stats(uid: ObjectId) -> dict:
+    doc = portfolio_stats_col.find_one({"_id": uid}) or {}
+    return {
+        "realized_profit": float(doc.get("realized", 0)),
+        "sales": int(doc.get("sales", 0)),
+        "realized_by_year": doc.get("by_year", {}),
+        "realized_by_symbol": {
+            k.replace("\uff0e", "."): v for k, v in doc.get("by_symbol", {}).items()
+        },
+    }
+
+
+def rebuild_portfolio_stats(uid: ObjectId | None = None) -> int:
+    """Recompute portfolio_stats_col from realized_col (migration / repair)."""
+    match = {} if uid is None else {"user_id": uid}
+    rows = realized_col.aggregate(
+        [
+            {"$match": match},
+            {
+                "$group": {
+                    "_id": {
+                        "user_id": "$user_id",
+                        "year": {"$year": "$ts"},
+                        "symbol": "$symbol",
+                    },
+                    "profit": {"$sum": "$profit"},
+                    "sales": {"$sum": 1},
+                }
+            },
+        ]
+    )
+    docs: dict = {}
+    for r in rows:
+        key = r["_id"]
+        doc = docs.setdefault(
+            key["user_id"],
+            {
+                "_id": key["user_id"],
+                "realized": 0.0,
+                "sales": 0,
+                "by_year": {},
+                "by_symbol": {},
+            },
+        )
+        year = str(key["year"]) if key.get("year") else "unknown"
+        sym = _stats_key(key.get("symbol") or "")
+        profit = float(r["profit"])
+        doc["realized"] += profit
+        doc["sales"] += r["sales"]
+        doc["by_year"][year] = doc["by_year"].get(year, 0.0) + profit
+        doc["by_symbol"][sym] = doc["by_symbol"].get(sym, 0.0) + profit
+
+    if docs:
+        portfolio_stats_col.bulk_write(
+            [ReplaceOne({"_id": k}, d, upsert=True) for k, d in docs.items()],
+            ordered=False,
+        )
+    if uid is None:
+        portfolio_stats_col.delete_many({"_id": {"$nin": list(docs)}})
+    elif not docs:
+        portfolio_stats_col.delete_one({"_id": uid})
+    print(f"📊 Portfolio stats rebuilt for {len(docs)} users")
+    return len(docs)
 
 
-def fetch_price(symbol: str) -> float | None:
-    """Unified fetcher using Twelve Data only."""
-    symbol = symbol.upper()
-    p = fetch_price_from_twelvedata(symbol)
-    if p is not None:
-        _set_db_price(symbol, p)
-        _set_mem_price(symbol, p)
-        return p
-    print(f"🚫 No valid price found for {symbol}")
+# =========================
+# Data versions (ETags)
+# =========================
+# users_col.data_version goes up after every write that changes a user's
+# holdings or sales. Prices are not versioned: responses that include them
+# fold the quotes they were built from into the ETag instead, so the tag
+# can't run ahead of what this worker's cache actually serves.
+def bump_user_version(uid: ObjectId):
+    users_col.update_one({"_id": uid}, {"$inc": {"data_version": 1}})
+
+
+def _validators(user: dict, request: Request, content: tuple = ()) -> dict:
+    """
+    ETag (plus Vary) headers for a response built from `user`'s data and,
+    for anything not covered by the version, `content` (e.g. the quotes).
+    The tag is weak: the compression middleware serves gzip and Brotli
+    bodies under it, which are equivalent but not byte-identical.
+    """
+    # JSON and columnar bodies of the same URL are different representations
+    fmt = _columnar_format(request) or "json"
+    tag = f"{user['_id']}-{user.get('data_version', 0)}-{fmt}"
+    if content:
+        tag += "-" + hashlib.blake2b(repr(content).encode(), digest_size=8).hexdigest()
+    return {"ETag": f'W/"{tag}"', "Vary": "Accept"}
+
+
+def _not_modified(request: Request, headers: dict) -> Response | None:
+    """A 304 response if the client's If-None-Match weakly matches our ETag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    if headers["ETag"].removeprefix("W/") in tags or "*" in tags:
+        return Response(status_code=304, headers=headers)
     return None
 
 
 # =========================
 # Continuous price refresher
 # =========================
-def continuous_price_refresher():
-    """Continuously fill missing/stale prices within the API rate limit."""
-    SLEEP_BETWEEN_CALLS = 60 / RATE_LIMIT_CALLS_PER_MIN  # ≈7.5 seconds
+def _drain_refresh_queue() -> list[str]:
+    with refresh_queue_lock:
+        queued = sorted(refresh_queue)
+        refresh_queue.clear()
+    refresh_wakeup.clear()
+    return queued
+
+
+def _forward_refresh_requests(symbols: list[str]):
+    """Hand symbols served stale on this (non-leader) worker to the leader."""
+    if symbols:
+        symbols_col.update_many(
+            {"_id": {"$in": symbols}},
+            {"$set": {"refresh_requested_at": time.time()}},
+        )
+
+
+def _claim_refresh_requests() -> list[str]:
+    """Symbols other workers asked the leader to refresh; clears the requests."""
+    query = {"refresh_requested_at": {"$exists": True}}
+    requested = [r["_id"] for r in symbols_col.find(query, {"_id": 1})]
+    if requested:
+        symbols_col.update_many(
+            {"_id": {"$in": requested}}, {"$unset": {"refresh_requested_at": ""}}
+        )
+    return requested
 
+
+# Only the lease holder runs the refresher, across all workers and replicas
+refresher_lease = MongoLease(leases_col, "price_refresher")
+
+# Decides which symbol the refresher fetches next
+refresh_scheduler = RefreshScheduler(
+    ttl_seconds=MARKET_OPEN_TTL_SECONDS, calendar=market_calendar
+)
+SCHEDULER_SYNC_SECONDS = 60
+# How often stale symbols are forwarded to / collected by the leader
+REFRESH_REQUEST_SECONDS = 2
+
+
+def _sync_refresh_scheduler():
+    """Reload held symbols with their holder count and position value."""
+    rows = list(symbols_col.find({"holders": {"$gt": 0}}))
+    quotes = price_cache.lookup_many([r["_id"] for r in rows], notify=False)
+    positions = {}
+    for r in rows:
+        q = quotes.get(r["_id"])
+        value = q.price * r["qty"] if q else r["cost"]
+        positions[r["_id"]] = (r["holders"], value)
+    expiries = {sym: q.expires_at for sym, q in quotes.items()}
+    not_before = {}
+    for sym in positions:
+        retry_at = price_cache.retry_at(sym)
+        if retry_at is not None:
+            not_before[sym] = retry_at
+    refresh_scheduler.sync(positions, expiries, not_before)
+
+
+def continuous_price_refresher():
+    """
+    Refresh prices in priority order: the scheduler hands out whichever
+    symbols are due (heaviest and most overdue first) and the refresher
+    fetches them in batches. Pacing comes from the providers' rate limiters,
+    where the refresher yields to user-initiated fetches. Every worker runs this loop,
+    but only the holder of `refresher_lease` does any fetching; the others
+    forward the symbols they served stale to it through symbols_col.
+    """
+    last_sync = last_claim = 0.0
     while True:
         try:
-            symbols = [s.upper() for s in holdings_col.distinct("symbol")]
-            for sym in symbols:
-                current = _get_mem_price(sym) or _get_db_price(sym)
-                if current is None:
-                    print(f"🔄 Fetching missing price for {sym} ...")
-                    price = fetch_price(sym)
-                    if price is not None:
-                        print(f"✅ Cached {sym} @ {price}")
+            if not refresher_lease.is_leader():
+                _forward_refresh_requests(_drain_refresh_queue())
+                refresher_lease.wait_for_leadership(REFRESH_REQUEST_SECONDS)
+                last_sync = 0.0
+                continue
+
+            if time.time() - last_sync >= SCHEDULER_SYNC_SECONDS:
+                _sync_refresh_scheduler()
+                last_sync = time.time()
+
+            # Symbols just served stale to a user, here or on another worker,
+            # jump the queue
+            refresh_scheduler.bump(_drain_refresh_queue())
+            if time.time() - last_claim >= REFRESH_REQUEST_SECONDS:
+                refresh_scheduler.bump(_claim_refresh_requests())
+                last_claim = time.time()
+
+            batch = refresh_scheduler.pop_due(price_providers.batch_size)
+            if batch:
+                print(f"🔄 Refreshing {len(batch)} prices: {', '.join(batch)}")
+                prices = fetch_prices(batch, PRIORITY_BACKGROUND)
+                quotes = price_cache.lookup_many(list(prices), notify=False)
+                for sym in batch:
+                    if sym in quotes:
+                        refresh_scheduler.fetched(sym, quotes[sym].expires_at)
                     else:
+                        retry_at = price_cache.retry_at(sym)
                         print(f"⚠️ Still missing {sym}, will retry later")
-                    time.sleep(SLEEP_BETWEEN_CALLS)
-            print("🕐 Cycle complete — waiting 60s before next sweep")
-            time.sleep(60)
+                        refresh_scheduler.failed(sym, retry_at)
+                continue
+
+            wait = min(
+                SCHEDULER_SYNC_SECONDS - (time.time() - last_sync),
+                REFRESH_REQUEST_SECONDS - (time.time() - last_claim),
+            )
+            next_due = refresh_scheduler.seconds_until_next()
+            if next_due is not None:
+                wait = min(wait, next_due)
+            refresh_wakeup.wait(max(wait, 0.5))
         except Exception as e:
             print(f"❌ Refresher error: {e}")
             time.sleep(60)
@@ -211,6 +672,27 @@ def health():
     return {"status": "ok" if ok else "degraded"}
 
 
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until the price cache has been warmed."""
+    if not price_cache.is_warm():
+        raise HTTPException(status_code=503, detail="Warming price cache")
+    return {"status": "ready"}
+
+
+@app.get("/metrics")
+def metrics():
+    """Runtime counters for monitoring."""
+    return {
+        "price_cache": price_cache.stats(),
+        "providers": price_providers.stats(),
+        "prefetch_queue": prefetch_queue.stats(),
+        "refresh_scheduler": refresh_scheduler.stats(),
+        "refresher_lease": refresher_lease.stats(),
+        "market": market_calendar.stats(),
+    }
+
+
 # =========================
 # Auth
 # =========================
@@ -262,6 +744,9 @@ def add_or_update_holding(req: Holding):
     Creates or updates a holding for the given user.
     - If it exists, overwrite qty & price directly (edit mode).
     - If it doesn’t, create a new record.
+    - The market price is fetched in the background; `price_status` says
+      whether one is "cached", "pending", "retrying" after a failed fetch,
+      or "unpriceable" (failed repeatedly); the last two come with retry_at.
     """
     user_id = _objid(req.user_id)
     sym = req.symbol.upper()
@@ -272,6 +757,11 @@ def add_or_update_holding(req: Holding):
             {"_id": existing["_id"]},
             {"$set": {"qty": float(req.qty), "price": float(req.price)}},
         )
+        registry_update(
+            sym,
+            (float(existing["qty"]), float(existing["price"])),
+            (float(req.qty), float(req.price)),
+        )
         print(f"🟢 Updated holding {sym} for user {user_id}")
         action = "updated"
     else:
@@ -283,16 +773,30 @@ def add_or_update_holding(req: Holding):
                 "user_id": user_id,
             }
         )
+        registry_update(sym, None, (float(req.qty), float(req.price)))
         print(f"🟢 Created new holding {sym} for user {user_id}")
         action = "created"
 
-    # Cache price best-effort
-    try:
-        fetch_price(sym)
-    except Exception as e:
-        print(f"⚠️ Could not fetch price for {sym}: {e}")
+    bump_user_version(user_id)
 
-    return {"status": "ok", "message": f"Holding {sym} {action} successfully"}
+    # Price is fetched in the background; report whether one is ready.
+    # Symbols backing off after failed fetches are not fetched until
+    # retry_at, so they are reported as such rather than "pending".
+    retry_at = None
+    if price_cache.get(sym) is not None:
+        price_status = "cached"
+    elif (retry_at := price_cache.retry_at(sym)) is not None:
+        price_status = "unpriceable" if price_cache.unpriceable([sym]) else "retrying"
+    else:
+        prefetch_queue.enqueue(sym)
+        price_status = "pending"
+
+    return {
+        "status": "ok",
+        "message": f"Holding {sym} {action} successfully",
+        "price_status": price_status,
+        "retry_at": datetime.utcfromtimestamp(retry_at) if retry_at else None,
+    }
 
 
 @app.delete("/holding/{symbol}")
@@ -305,13 +809,15 @@ def delete_holding(symbol: str, user_id: str = Query(...)):
     uid = _objid(user_id)
 
     print(f"🗑️ Attempting to delete holding {sym} for user {uid}")
-    result = holdings_col.delete_one({"symbol": sym, "user_id": uid})
+    deleted = holdings_col.find_one_and_delete({"symbol": sym, "user_id": uid})
 
-    if result.deleted_count == 0:
+    if deleted is None:
         print(f"⚠️ No holding found for {sym} with user_id {uid}")
         raise HTTPException(
             status_code=404, detail=f"Holding {sym} not found for this user"
         )
+    registry_update(sym, (float(deleted["qty"]), float(deleted["price"])), None)
+    bump_user_version(uid)
 
     print(f"✅ Deleted holding {sym} for user {uid}")
     return {"status": "ok", "message": f"Deleted {sym}"}
@@ -336,28 +842,31 @@ def sell_holding(symbol: str, req: SellRequest):
     sell_price = (
         float(req.price)
         if req.price is not None
-        else (_get_mem_price(sym) or _get_db_price(sym) or buy_price)
+        else (price_cache.get(sym) or buy_price)
     )
     profit = (sell_price - buy_price) * qty_to_sell
 
-    realized_col.insert_one(
-        {
-            "symbol": sym,
-            "qty": qty_to_sell,
-            "buy_price": buy_price,
-            "sell_price": sell_price,
-            "profit": profit,
-            "user_id": uid,
-            "ts": datetime.utcnow(),
-        }
-    )
+    sale = {
+        "symbol": sym,
+        "qty": qty_to_sell,
+        "buy_price": buy_price,
+        "sell_price": sell_price,
+        "profit": profit,
+        "user_id": uid,
+        "ts": datetime.utcnow(),
+    }
+    realized_col.insert_one(sale)
+    stats_record_sale(uid, sale)
+    bump_user_version(uid)
 
     new_qty = float(h["qty"]) - qty_to_sell
     if new_qty <= 0:
         holdings_col.delete_one({"_id": h["_id"]})
+        registry_update(sym, (float(h["qty"]), buy_price), None)
         print(f"💸 Sold out of {sym}, holding removed.")
     else:
         holdings_col.update_one({"_id": h["_id"]}, {"$set": {"qty": new_qty}})
+        registry_update(sym, (float(h["qty"]), buy_price), (new_qty, buy_price))
         print(f"💸 Sold {qty_to_sell} of {sym}, remaining {new_qty} shares.")
 
     return {"status": "ok", "realized_profit": profit}
@@ -366,29 +875,97 @@ def sell_holding(symbol: str, req: SellRequest):
 # =========================
 # Portfolio
 # =========================
+def _portfolio_rows(uid: ObjectId) -> tuple[list[dict], float]:
+    """
+    Open holdings plus the realized-profit total in one round trip: the
+    holdings match is followed by a $unionWith that reads the user's
+    precomputed portfolio_stats doc, so the cost doesn't grow with the
+    length of the sales history.
+    """
+    pipeline = [
+        {"$match": {"user_id": uid, "qty": {"$gt": 0}}},
+        {"$project": {"_id": 0, "symbol": 1, "qty": 1, "price": 1}},
+        {
+            "$unionWith": {
+                "coll": portfolio_stats_col.name,
+                "pipeline": [
+                    {"$match": {"_id": uid}},
+                    {"$project": {"_id": 0, "realized_profit": "$realized"}},
+                ],
+            }
+        },
+    ]
+    holdings: list[dict] = []
+    realized = 0.0
+    for row in holdings_col.aggregate(pipeline):
+        if "realized_profit" in row:
+            realized = float(row["realized_profit"] or 0)
+        else:
+            holdings.append(row)
+    return holdings, realized
+
+
+PORTFOLIO_COLUMNS = {
+    "symbol": "string",
+    "qty": "float64",
+    "avg_price": "float64",
+    "current_price": "float64",
+    "value": "float64",
+    "unrealized_profit": "float64",
+    "is_stale": "bool",
+    "as_of": "timestamp",
+    "warning": "string",
+}
+
+
 @app.get("/portfolio")
-def get_portfolio(user_id: str = Query(...)):
+def get_portfolio(request: Request, user_id: str = Query(...)):
+    """
+    Holdings with current valuation plus the realized-profit total.
+    Send `Accept: application/vnd.apache.arrow.stream` (or Parquet) to get
+    the holdings as a table with realized_profit in the schema metadata.
+    Supports If-None-Match: the ETag covers the user's data version and
+    the quotes (price, fetch time, staleness) the body is built from.
+    """
     uid = _objid(user_id)
-    user = users_col.find_one({"_id": uid})
+    # Read the version before the data so a concurrent write can only make
+    # the ETag older than the body, never newer
+    user = users_col.find_one({"_id": uid}, {"data_version": 1})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    holdings = list(holdings_col.find({"user_id": uid, "qty": {"$gt": 0}}))
+    holdings, realized = _portfolio_rows(uid)
+    symbols = [h["symbol"].upper() for h in holdings]
+    quotes = price_cache.lookup_many(symbols)
+    unpriceable = price_cache.unpriceable([s for s in symbols if s not in quotes])
+
+    content = (
+        realized,
+        sorted((s, q.price, q.as_of, q.is_stale) for s, q in quotes.items()),
+        sorted(unpriceable),
+    )
+    headers = _validators(user, request, content)
+    not_modified = _not_modified(request, headers)
+    if not_modified:
+        return not_modified
 
     results = []
     for h in holdings:
         sym = h["symbol"].upper()
         qty = float(h["qty"])
         avg_price = float(h["price"])
-        current_price = _get_mem_price(sym) or _get_db_price(sym)
+        quote = quotes.get(sym)
 
         entry = {"symbol": sym, "qty": qty, "avg_price": avg_price}
-        if current_price is not None:
+        if quote is not None:
+            current_price = quote.price
             entry.update(
                 {
                     "current_price": round(current_price, 2),
                     "value": round(current_price * qty, 2),
                     "unrealized_profit": round((current_price - avg_price) * qty, 2),
+                    "is_stale": quote.is_stale,
+                    "as_of": datetime.utcfromtimestamp(quote.as_of),
                 }
             )
         else:
@@ -397,36 +974,127 @@ def get_portfolio(user_id: str = Query(...)):
                     "current_price": None,
                     "value": None,
                     "unrealized_profit": None,
-                    "warning": "price_unavailable",
+                    "is_stale": None,
+                    "as_of": None,
+                    "warning": (
+                        "unpriceable" if sym in unpriceable else "price_unavailable"
+                    ),
                 }
             )
         results.append(entry)
 
-    realized = sum(
-        float(x.get("profit", 0)) for x in realized_col.find({"user_id": uid})
+    fmt = _columnar_format(request)
+    if fmt:
+        meta = {"realized_profit": realized}
+        return _columnar_response(results, fmt, PORTFOLIO_COLUMNS, meta, headers)
+    return FastJSONResponse(
+        {"holdings": results, "realized_profit": realized}, headers=headers
     )
-    return {"holdings": results, "realized_profit": realized}
+
+
+SALES_PAGE_MAX = 500
+
+
+def _encode_cursor(sale: dict) -> str:
+    raw = f"{sale['ts'].isoformat()}|{sale['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    try:
+        ts, oid = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(ts), ObjectId(oid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _sales_query(
+    uid: ObjectId, symbol: str | None, start: date | None, end: date | None
+) -> dict:
+    query: dict = {"user_id": uid}
+    if symbol:
+        query["symbol"] = symbol.upper()
+    ts_range = {}
+    if start:
+        ts_range["$gte"] = datetime.combine(start, datetime.min.time())
+    if end:
+        ts_range["$lt"] = datetime.combine(end + timedelta(days=1), datetime.min.time())
+    if ts_range:
+        query["ts"] = ts_range
+    return query
+
+
+SALE_COLUMNS = {
+    "id": "string",
+    "symbol": "string",
+    "qty": "float64",
+    "buy_price": "float64",
+    "sell_price": "float64",
+    "profit": "float64",
+    "timestamp": "timestamp",
+}
+
+
+def _sale_row(s: dict) -> dict:
+    return {
+        "id": str(s["_id"]),
+        "symbol": s.get("symbol"),
+        "qty": float(s.get("qty", 0)),
+        "buy_price": float(s.get("buy_price", 0)),
+        "sell_price": float(s.get("sell_price", 0)),
+        "profit": float(s.get("profit", 0)),
+        "timestamp": s.get("ts"),
+    }
 
 
 @app.get("/sales_history")
-def get_sales_history(user_id: str = Query(...)):
-    """Return all realized sales for the given user."""
+def get_sales_history(
+    request: Request,
+    user_id: str = Query(...),
+    limit: int = Query(100, ge=1, le=SALES_PAGE_MAX),
+    after: str | None = Query(None, description="next_cursor from the last page"),
+    symbol: str | None = Query(None),
+    start: date | None = Query(None, description="first day to include"),
+    end: date | None = Query(None, description="last day to include"),
+):
+    """
+    Realized sales for the given user, newest first, one page at a time.
+    Pages are keyed on (ts, _id): pass the returned `next_cursor` as `after`
+    to get the next page; it is None on the last one. Arrow / Parquet
+    responses (via Accept) carry next_cursor in the schema metadata.
+    Supports If-None-Match against the user's data version.
+    """
     uid = _objid(user_id)
-    sales = list(realized_col.find({"user_id": uid}).sort("ts", -1))
-    results = []
-    for s in sales:
-        results.append(
-            {
-                "id": str(s["_id"]),
-                "symbol": s.get("symbol"),
-                "qty": float(s.get("qty", 0)),
-                "buy_price": float(s.get("buy_price", 0)),
-                "sell_price": float(s.get("sell_price", 0)),
-                "profit": float(s.get("profit", 0)),
-                "timestamp": s.get("ts"),
-            }
-        )
-    return {"sales": results}
+    user = users_col.find_one({"_id": uid}, {"data_version": 1}) or {"_id": uid}
+    headers = _validators(user, request)
+    not_modified = _not_modified(request, headers)
+    if not_modified:
+        return not_modified
+
+    query = _sales_query(uid, symbol, start, end)
+    if after:
+        ts, oid = _decode_cursor(after)
+        query["$or"] = [{"ts": {"$lt": ts}}, {"ts": ts, "_id": {"$lt": oid}}]
+
+    sales = list(
+        realized_col.find(query)
+        .sort([("ts", DESCENDING), ("_id", DESCENDING)])
+        .limit(limit + 1)
+    )
+    next_cursor = _encode_cursor(sales[limit - 1]) if len(sales) > limit else None
+    rows = [_sale_row(s) for s in sales[:limit]]
+    fmt = _columnar_format(request)
+    if fmt:
+        meta = {"next_cursor": next_cursor}
+        return _columnar_response(rows, fmt, SALE_COLUMNS, meta, headers)
+    body = {"sales": rows, "next_cursor": next_cursor}
+    return FastJSONResponse(body, headers=headers)
+
+
+@app.get("/portfolio_stats")
+def get_portfolio_stats(user_id: str = Query(...)):
+    """Precomputed realized totals (overall, by year, by symbol)."""
+    return get_stats(_objid(user_id))
 
 
 @app.delete("/sales_history/{sale_id}")
@@ -435,48 +1103,166 @@ def delete_sale_record(sale_id: str, user_id: str = Query(...)):
     try:
         uid = _objid(user_id)
         sid = ObjectId(sale_id)
-        result = realized_col.delete_one({"_id": sid, "user_id": uid})
-        if result.deleted_count == 0:
+        sale = realized_col.find_one_and_delete({"_id": sid, "user_id": uid})
+        if sale is None:
             raise HTTPException(
                 status_code=404, detail="Sale not found or not authorized to delete."
             )
+        stats_record_sale(uid, sale, sign=-1)
+        bump_user_version(uid)
         return {"status": "ok", "message": "Sale deleted."}
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to delete sale: {e}")
 
 
 # =========================
-# Collectr Scraper
+# Export
 # =========================
-@app.get("/collectr_value")
-def get_collectr_value(url: str = Query(..., description="Full Collectr app link")):
+EXPORT_BATCH_SIZE = 1000
+HOLDING_COLUMNS = {
+    "symbol": "string",
+    "qty": "float64",
+    "avg_price": "float64",
+    "current_price": "float64",
+    "as_of": "timestamp",
+}
+
+
+def _export_response(rows, format: str, columns: dict[str, str], name: str):
+    """Stream `rows` (a lazy iterator over a cursor) as a download."""
     try:
-        headers = {"User-Agent": "Mozilla/5.0"}
-        resp = requests.get(url, headers=headers, timeout=10)
-        if resp.status_code != 200:
-            raise HTTPException(status_code=400, detail="Could not access the page")
+        chunks = export_chunks(rows, format, columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_type, ext = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{name}.{ext}"'},
+    )
 
-        soup = BeautifulSoup(resp.text, "html.parser")
-        value_el = soup.find(string=lambda t: t and "$" in t and "Collection" in t)
-        if not value_el:
-            value_el = soup.find(
-                lambda tag: tag.name in ["span", "div"] and "$" in tag.text
-            )
 
-        if not value_el:
-            raise HTTPException(
-                status_code=404, detail="Could not find collection value on page"
-            )
+@app.get("/export/sales")
+def export_sales(
+    user_id: str = Query(...),
+    format: str = Query("ndjson", description="ndjson, csv, arrow or parquet"),
+    symbol: str | None = Query(None),
+    start: date | None = Query(None),
+    end: date | None = Query(None),
+):
+    """Every matching sale, newest first, streamed straight off the cursor."""
+    cursor = (
+        realized_col.find(_sales_query(_objid(user_id), symbol, start, end))
+        .sort([("ts", DESCENDING), ("_id", DESCENDING)])
+        .batch_size(EXPORT_BATCH_SIZE)
+    )
+    rows = (_sale_row(s) for s in cursor)
+    return _export_response(rows, format, SALE_COLUMNS, "sales")
+
+
+def _holding_rows(cursor):
+    """Holdings with their cached price, looked up one cursor batch at a time."""
+    batch: list[dict] = []
+    for h in cursor:
+        batch.append(h)
+        if len(batch) == EXPORT_BATCH_SIZE:
+            yield from _priced_holdings(batch)
+            batch = []
+    yield from _priced_holdings(batch)
+
+
+def _priced_holdings(batch: list[dict]):
+    quotes = price_cache.lookup_many([h["symbol"].upper() for h in batch], notify=False)
+    for h in batch:
+        quote = quotes.get(h["symbol"].upper())
+        yield {
+            "symbol": h["symbol"].upper(),
+            "qty": float(h["qty"]),
+            "avg_price": float(h["price"]),
+            "current_price": quote.price if quote else None,
+            "as_of": datetime.utcfromtimestamp(quote.as_of) if quote else None,
+        }
+
+
+@app.get("/export/holdings")
+def export_holdings(
+    user_id: str = Query(...),
+    format: str = Query("ndjson", description="ndjson, csv, arrow or parquet"),
+):
+    """Open holdings with their latest cached price."""
+    cursor = (
+        holdings_col.find({"user_id": _objid(user_id), "qty": {"$gt": 0}})
+        .sort("symbol", ASCENDING)
+        .batch_size(EXPORT_BATCH_SIZE)
+    )
+    return _export_response(_holding_rows(cursor), format, HOLDING_COLUMNS, "holdings")
+
+
+# =========================
+# Price history
+# =========================
+@app.get("/prices/{symbol}/history")
+def get_price_history(
+    symbol: str,
+    range: str = Query("1mo", description="1d, 5d, 1mo, 3mo, 6mo, 1y, 5y or max"),
+    resolution: str = Query("auto", description="auto, raw, 1m, 1h or 1d"),
+):
+    """OHLC history for a symbol, served from the pre-computed rollups."""
+    sym = symbol.upper()
+    try:
+        used, points = price_history.query(sym, range, resolution)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(
+        {"symbol": sym, "range": range, "resolution": used, "points": points}
+    )
 
-        import re
 
-        match = re.search(
-            r"\$([\d,\.]+)", value_el if isinstance(value_el, str) else value_el.text
+# =========================
+# Collectr Scraper
+# =========================
+async def _scrape(url: str) -> httpx.Response:
+    if scraper_http is not None:
+        return await scraper_http.get(url)
+    # App started without lifespan events (e.g. a bare TestClient)
+    async with make_scraper_client(1, 0) as http:
+        return await http.get(url)
+
+
+def _parse_collectr_value(html: str) -> float:
+    """Pull the collection value out of a Collectr page (CPU-bound)."""
+    soup = BeautifulSoup(html, "html.parser")
+    value_el = soup.find(string=lambda t: t and "$" in t and "Collection" in t)
+    if not value_el:
+        value_el = soup.find(
+            lambda tag: tag.name in ["span", "div"] and "$" in tag.text
+        )
+
+    if not value_el:
+        raise HTTPException(
+            status_code=404, detail="Could not find collection value on page"
         )
-        if not match:
-            raise HTTPException(status_code=404, detail="Could not parse value")
 
-        value = float(match.group(1).replace(",", ""))
+    match = re.search(
+        r"\$([\d,\.]+)", value_el if isinstance(value_el, str) else value_el.text
+    )
+    if not match:
+        raise HTTPException(status_code=404, detail="Could not parse value")
+
+    return float(match.group(1).replace(",", ""))
+
+
+@app.get("/collectr_value")
+async def get_collectr_value(
+    url: str = Query(..., description="Full Collectr app link")
+):
+    try:
+        resp = await _scrape(url)
+        if resp.status_code != 200:
+            raise HTTPException(status_code=400, detail="Could not access the page")
+
+        # Parsing runs in the threadpool so it doesn't block the event loop
+        value = await run_in_threadpool(_parse_collectr_value, resp.text)
         return {"total_value": value}
     except HTTPException:
         raise
@@ -485,8 +1271,37 @@ def get_collectr_value(url: str = Query(..., description="Full Collectr app link
 
 
 # =========================
-# Startup
+# Startup & shutdown
 # =========================
 @app.on_event("startup")
 def on_startup():
+    # One-time migration for databases that predate the registry
+    if symbols_col.estimated_document_count() == 0:
+        rebuild_symbol_registry()
+    if portfolio_stats_col.estimated_document_count() == 0:
+        rebuild_portfolio_stats()
+    price_cache.start()
+    prefetch_queue.start()
+    refresher_lease.start()
     threading.Thread(target=continuous_price_refresher, daemon=True).start()
+
+
+@app.on_event("startup")
+async def open_http_clients():
+    global scraper_http
+    scraper_http = make_scraper_client(
+        SCRAPER_HTTP_MAX_CONNECTIONS, SCRAPER_HTTP_MAX_KEEPALIVE
+    )
+
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    if scraper_http is not None:
+        await scraper_http.aclose()
+    provider_http.close()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    refresher_lease.release()
+    price_cache.close()
@@ -0,0 +1,32 @@
+"""
+Maintenance commands, run from backend/:
+    python manage.py rebuild-stats [--user USER_ID]
+    python manage.py rebuild-symbols
+"""
+import argparse
+
+import main
+
+
+def cmd_rebuild_stats(args):
+    uid = main._objid(args.user) if args.user else None
+    main.rebuild_portfolio_stats(uid)
+
+
+def cmd_rebuild_symbols(args):
+    main.rebuild_symbol_registry()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("rebuild-stats", help="recompute portfolio_stats from sales")
+    p.add_argument("--user", help="only this user_id (default: everyone)")
+    p.set_defaults(func=cmd_rebuild_stats)
+
+    p = sub.add_parser("rebuild-symbols", help="recompute the symbol registry")
+    p.set_defaults(func=cmd_rebuild_symbols)
+
+    args = parser.parse_args()
+    args.func(args)
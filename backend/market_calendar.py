@@ -0,0 +1,105 @@
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+DEFAULT_CALENDAR_FILE = os.path.join(os.path.dirname(__file__), "market_holidays.json")
+
+
+def _clock(value: str):
+    return datetime.strptime(value, "%H:%M").time()
+
+
+class ExchangeCalendar:
+    """
+    Trading sessions for one exchange, loaded from a JSON file with its
+    timezone, regular open/close times, full-day holidays and early closes
+    (see market_holidays.json). Days past the end of the holiday table are
+    treated as regular weekdays, which errs on the side of refreshing.
+
+    Cached prices expire `open_ttl` seconds after they are fetched while the
+    market is open, and at the latest `settle_seconds` after the close so the
+    closing price gets picked up. Prices fetched while the market is closed
+    stay valid until the next open.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        open_ttl: float = 900,
+        settle_seconds: float = 900,
+    ):
+        with open(path or DEFAULT_CALENDAR_FILE) as f:
+            data = json.load(f)
+        self.exchange = data.get("exchange", "")
+        self.tz = ZoneInfo(data["timezone"])
+        self.open_time = _clock(data["open"])
+        self.close_time = _clock(data["close"])
+        self.holidays = {date.fromisoformat(d) for d in data.get("holidays", [])}
+        self.early_closes = {
+            date.fromisoformat(d): _clock(t)
+            for d, t in data.get("early_closes", {}).items()
+        }
+        self.open_ttl = open_ttl
+        self.settle_seconds = settle_seconds
+
+    def session(self, day: date) -> tuple[float, float] | None:
+        """(open, close) timestamps for `day`, or None if it is not a trading day."""
+        if day.weekday() >= 5 or day in self.holidays:
+            return None
+        close = self.early_closes.get(day, self.close_time)
+        return (
+            datetime.combine(day, self.open_time, self.tz).timestamp(),
+            datetime.combine(day, close, self.tz).timestamp(),
+        )
+
+    def _today(self, ts: float) -> tuple[float, float] | None:
+        return self.session(datetime.fromtimestamp(ts, self.tz).date())
+
+    def is_open(self, ts: float | None = None) -> bool:
+        ts = time.time() if ts is None else ts
+        s = self._today(ts)
+        return s is not None and s[0] <= ts < s[1]
+
+    def next_open(self, ts: float | None = None) -> float:
+        """Start of the first session that opens after `ts`."""
+        ts = time.time() if ts is None else ts
+        day = datetime.fromtimestamp(ts, self.tz).date()
+        for i in range(15):
+            s = self.session(day + timedelta(days=i))
+            if s is not None and s[0] > ts:
+                return s[0]
+        return ts + 86400  # holiday table makes no sense; check again tomorrow
+
+    def next_active(self, ts: float) -> float:
+        """
+        `ts` itself if prices can move (or just settled) then, otherwise the
+        next open. Used to push refreshes out of closed hours.
+        """
+        s = self._today(ts)
+        if s is not None and s[0] <= ts < s[1] + self.settle_seconds:
+            return ts
+        return self.next_open(ts)
+
+    def expires_at(self, fetched_at: float | None = None) -> float:
+        """When a price fetched at `fetched_at` stops being fresh."""
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        s = self._today(fetched_at)
+        if s is not None and s[0] <= fetched_at < s[1]:
+            return min(fetched_at + self.open_ttl, s[1] + self.settle_seconds)
+        return self.next_open(fetched_at)
+
+    def ttl(self, now: float | None = None) -> float:
+        """Seconds a price fetched `now` stays fresh."""
+        now = time.time() if now is None else now
+        return self.expires_at(now) - now
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "exchange": self.exchange,
+            "is_open": self.is_open(now),
+            "next_open": datetime.utcfromtimestamp(self.next_open(now)),
+            "price_ttl": round(self.ttl(now)),
+        }
@@ -0,0 +1,84 @@
+import threading
+import time
+from typing import Callable
+
+
+class PrefetchQueue:
+    """
+    Deduplicating queue of symbols whose price should be fetched soon.
+    Request handlers `enqueue()` and return immediately; a single worker
+    thread drains the queue in batches of up to `batch_size`, lingering
+    briefly so symbols added together share one provider call. Rate limiting
+    is left to `fetch_fn` (which goes through the shared token bucket).
+    """
+
+    def __init__(
+        self,
+        fetch_fn: Callable[[list[str]], dict[str, float]],
+        batch_size: int,
+        linger_seconds: float = 0.25,
+    ):
+        self.fetch_fn = fetch_fn
+        self.batch_size = batch_size
+        self.linger_seconds = linger_seconds
+        self._queued: dict[str, None] = {}  # insertion-ordered set
+        self._in_progress: set[str] = set()
+        self._cond = threading.Condition()
+        self._worker: threading.Thread | None = None
+        self._fetched = 0
+        self._failed = 0
+
+    def enqueue(self, symbol: str):
+        with self._cond:
+            if symbol not in self._in_progress:
+                self._queued[symbol] = None
+                self._cond.notify()
+
+    def is_pending(self, symbol: str) -> bool:
+        with self._cond:
+            return symbol in self._queued or symbol in self._in_progress
+
+    def _next_batch(self) -> list[str]:
+        with self._cond:
+            while not self._queued:
+                self._cond.wait()
+        # Give concurrent requests a moment to join this batch
+        time.sleep(self.linger_seconds)
+        with self._cond:
+            batch = list(self._queued)[: self.batch_size]
+            for sym in batch:
+                del self._queued[sym]
+            self._in_progress.update(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                prices = self.fetch_fn(batch)
+                missing = [s for s in batch if s not in prices]
+                with self._cond:
+                    self._fetched += len(batch) - len(missing)
+                    self._failed += len(missing)
+            except Exception as e:
+                print(f"❌ Prefetch error for {', '.join(batch)}: {e}")
+                with self._cond:
+                    self._failed += len(batch)
+            finally:
+                with self._cond:
+                    self._in_progress.difference_update(batch)
+
+    def start(self):
+        """Start the worker thread (idempotent)."""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queued": len(self._queued),
+                "in_progress": len(self._in_progress),
+                "fetched": self._fetched,
+                "failed": self._failed,
+            }
@@ -0,0 +1,480 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple
+
+from pymongo import UpdateOne
+
+
+class PriceQuote(NamedTuple):
+    price: float
+    as_of: float  # epoch seconds when the price was fetched
+    is_stale: bool
+    expires_at: float
+
+
+class WriteBehindBuffer:
+    """
+    Collects upserts for the L2 collection and writes them with one unordered
+    bulk_write of UpdateOne(upsert=True) ops. Updates to the same symbol are
+    merged, so a burst of refreshes costs one write per symbol. Flushes when
+    `max_batch` symbols are pending, every `flush_interval` seconds from the
+    background thread, and on `close()`.
+    """
+
+    def __init__(self, collection, max_batch: int = 500, flush_interval: float = 2):
+        self.col = collection
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        # { "AAPL": ({"$set" fields}, {"$unset" fields}) }
+        self._pending: dict[str, tuple[dict, set[str]]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._counters = {"flushes": 0, "written": 0, "errors": 0}
+
+    def _merge(self, symbol: str, fields: dict, unset: set[str]):
+        cur_set, cur_unset = self._pending.get(symbol, ({}, set()))
+        cur_set = {k: v for k, v in cur_set.items() if k not in unset}
+        cur_set.update(fields)
+        self._pending[symbol] = (cur_set, (cur_unset - fields.keys()) | unset)
+
+    def add(self, symbol: str, fields: dict, unset: set[str] | None = None):
+        with self._lock:
+            self._merge(symbol, fields, unset or set())
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self.flush()
+
+    def delete(self, symbol: str):
+        """
+        Forget any pending write for `symbol` and delete its document.
+        Holds the flush lock so a flush already in progress (or its retry
+        re-queue) cannot upsert the document again afterwards.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._pending.pop(symbol, None)
+            self.col.delete_one({"symbol": symbol})
+
+    def flush(self) -> int:
+        """Write everything pending. Returns the number of symbols written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            ops = []
+            for sym, (fields, unset) in pending.items():
+                update: dict = {"$set": {"symbol": sym, **fields}}
+                if unset:
+                    update["$unset"] = {k: "" for k in unset}
+                ops.append(UpdateOne({"symbol": sym}, update, upsert=True))
+            try:
+                self.col.bulk_write(ops, ordered=False)
+            except Exception as e:
+                print(f"❌ Price cache flush failed ({len(ops)} symbols): {e}")
+                with self._lock:
+                    self._counters["errors"] += 1
+                    # Put them back, without overriding anything newer
+                    for sym, (fields, unset) in pending.items():
+                        newer = self._pending.pop(sym, None)
+                        self._merge(sym, fields, unset)
+                        if newer:
+                            self._merge(sym, *newer)
+                return 0
+            with self._lock:
+                self._counters["flushes"] += 1
+                self._counters["written"] += len(ops)
+            return len(ops)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        """Start the periodic flusher (idempotent)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the flusher and write whatever is left."""
+        self._stop.set()
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "pending": len(self._pending)}
+
+
+class PriceCache:
+    """
+    Two-tier price cache.
+    - L1: in-process LRU capped at `max_entries`, each entry with its own expiry.
+    - L2: the Mongo `prices_cache` collection, shared by every worker,
+      written behind through a WriteBehindBuffer.
+    Expired prices are kept for up to `stale_seconds` so they can still be
+    served (flagged stale) while `on_stale` queues a refresh. A background
+    sweeper drops entries past that window so memory stays bounded even for
+    symbols that are never read again.
+
+    Symbols the provider could not price are negatively cached: each
+    consecutive failure doubles the wait before the next attempt (from
+    `retry_base_seconds` up to `retry_max_seconds`), and after
+    `unpriceable_after` failures the symbol is reported as unpriceable.
+    """
+
+    def __init__(
+        self,
+        collection,
+        ttl_seconds: float,
+        max_entries: int = 5000,
+        sweep_interval: float = 60,
+        stale_seconds: float = 0,
+        on_stale: Callable[[list[str]], None] | None = None,
+        retry_base_seconds: float = 300,
+        retry_max_seconds: float = 86400,
+        unpriceable_after: int = 3,
+        write_batch: int = 500,
+        write_interval: float = 2,
+    ):
+        self.col = collection
+        self.writes = WriteBehindBuffer(collection, write_batch, write_interval)
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.on_stale = on_stale
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.unpriceable_after = unpriceable_after
+        # { "AAPL": (price, fetched_at, expires_at) }
+        self._entries: OrderedDict[str, tuple[float, float, float]] = OrderedDict()
+        # { "XXXX": (consecutive_failures, retry_at) }
+        self._negative: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "l1_hits": 0,
+            "l2_hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "fetch_failures": 0,
+        }
+        self._sweeper: threading.Thread | None = None
+        self._warm = threading.Event()
+
+    # ---------- L1 ----------
+    def _l1_get(self, symbol: str, now: float) -> tuple[float, float, float] | None:
+        e = self._entries.get(symbol)
+        if e is None:
+            return None
+        if now >= e[2] + self.stale_seconds:
+            del self._entries[symbol]
+            self._counters["expirations"] += 1
+            return None
+        self._entries.move_to_end(symbol)
+        return e
+
+    def _l1_put(self, symbol: str, price: float, fetched_at: float, expires_at: float):
+        self._entries[symbol] = (price, fetched_at, expires_at)
+        self._entries.move_to_end(symbol)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    # ---------- L2 ----------
+    def _doc_expiry(self, doc: dict) -> tuple[float, float]:
+        fetched_at = float(doc.get("updated_at", 0))
+        expires_at = doc.get("expires_at")
+        if expires_at is None:
+            expires_at = fetched_at + self.ttl_seconds
+        return fetched_at, float(expires_at)
+
+    # ---------- Public API ----------
+    def get(self, symbol: str) -> float | None:
+        """Return a fresh price for `symbol`, or None."""
+        return self.get_many([symbol]).get(symbol)
+
+    def get_many(self, symbols: list[str]) -> dict[str, float]:
+        """Fresh prices only; symbols without one are left out."""
+        quotes = self.lookup_many(symbols, allow_stale=False)
+        return {sym: q.price for sym, q in quotes.items()}
+
+    def lookup_many(
+        self, symbols: list[str], allow_stale: bool = True, notify: bool = True
+    ) -> dict[str, PriceQuote]:
+        """
+        Resolve many symbols at once: fresh L1 entries first, then a single
+        $in query against L2 for the rest (another worker may have refreshed
+        them). With `allow_stale`, expired prices inside the stale window are
+        returned with `is_stale=True` and, if `notify`, handed to `on_stale`
+        for refresh.
+        """
+        now = time.time()
+        quotes: dict[str, PriceQuote] = {}
+        l1_stale: dict[str, tuple[float, float, float]] = {}
+        missing: list[str] = []
+        with self._lock:
+            for sym in dict.fromkeys(symbols):
+                e = self._l1_get(sym, now)
+                if e is not None and now < e[2]:
+                    quotes[sym] = PriceQuote(e[0], e[1], False, e[2])
+                    self._counters["l1_hits"] += 1
+                else:
+                    if e is not None:
+                        l1_stale[sym] = e
+                    missing.append(sym)
+
+        if not missing:
+            return quotes
+
+        projection = {
+            "_id": 0,
+            "symbol": 1,
+            "price": 1,
+            "updated_at": 1,
+            "expires_at": 1,
+            "failures": 1,
+            "retry_at": 1,
+        }
+        found: dict[str, tuple[float, float, float]] = {}
+        negative: dict[str, tuple[int, float]] = {}
+        for doc in self.col.find({"symbol": {"$in": missing}}, projection):
+            if doc.get("failures"):
+                negative[doc["symbol"]] = (
+                    int(doc["failures"]),
+                    float(doc.get("retry_at", 0)),
+                )
+            if "price" not in doc:
+                continue
+            fetched_at, expires_at = self._doc_expiry(doc)
+            if now < expires_at + self.stale_seconds:
+                found[doc["symbol"]] = (float(doc["price"]), fetched_at, expires_at)
+
+        stale: list[str] = []
+        with self._lock:
+            for sym, entry in negative.items():
+                local = self._negative.get(sym)
+                if local is None or entry[0] > local[0]:
+                    self._negative_put(sym, entry)
+            for sym in missing:
+                candidates = [e for e in (found.get(sym), l1_stale.get(sym)) if e]
+                if not candidates:
+                    self._counters["misses"] += 1
+                    continue
+                price, fetched_at, expires_at = max(candidates, key=lambda e: e[1])
+                self._l1_put(sym, price, fetched_at, expires_at)
+                if now < expires_at:
+                    quotes[sym] = PriceQuote(price, fetched_at, False, expires_at)
+                    self._counters["l2_hits"] += 1
+                elif allow_stale:
+                    quotes[sym] = PriceQuote(price, fetched_at, True, expires_at)
+                    self._counters["stale_hits"] += 1
+                    stale.append(sym)
+                else:
+                    self._counters["misses"] += 1
+
+        if stale and notify and self.on_stale is not None:
+            try:
+                self.on_stale(stale)
+            except Exception as e:
+                print(f"⚠️ Could not queue refresh for stale prices: {e}")
+        return quotes
+
+    def set(self, symbol: str, price: float, ttl: float | None = None):
+        """Write a freshly fetched price through both tiers."""
+        now = time.time()
+        expires_at = now + (self.ttl_seconds if ttl is None else ttl)
+        price = float(price)
+        with self._lock:
+            self._l1_put(symbol, price, now, expires_at)
+            self._negative.pop(symbol, None)
+        self.writes.add(
+            symbol,
+            {"price": price, "updated_at": now, "expires_at": expires_at},
+            unset={"failures", "retry_at"},
+        )
+
+    def discard(self, symbol: str):
+        """Forget `symbol` in both tiers (e.g. nobody holds it anymore)."""
+        with self._lock:
+            self._entries.pop(symbol, None)
+            self._negative.pop(symbol, None)
+        self.writes.delete(symbol)
+
+    # ---------- Negative cache ----------
+    def _negative_put(self, symbol: str, entry: tuple[int, float]):
+        self._negative[symbol] = entry
+        self._negative.move_to_end(symbol)
+        while len(self._negative) > self.max_entries:
+            self._negative.popitem(last=False)
+
+    def mark_failed(self, symbols: list[str]) -> dict[str, float]:
+        """
+        Record a failed fetch for each symbol and back off exponentially.
+        Returns {symbol: retry_at}.
+        """
+        if not symbols:
+            return {}
+        now = time.time()
+        retry: dict[str, float] = {}
+        counts: dict[str, int] = {}
+        with self._lock:
+            for sym in symbols:
+                failures = self._negative.get(sym, (0, 0.0))[0] + 1
+                delay = min(
+                    self.retry_base_seconds * 2 ** (failures - 1),
+                    self.retry_max_seconds,
+                )
+                retry[sym] = now + delay * random.uniform(0.9, 1.1)
+                self._negative_put(sym, (failures, retry[sym]))
+                counts[sym] = failures
+            self._counters["fetch_failures"] += len(symbols)
+        for sym, retry_at in retry.items():
+            self.writes.add(sym, {"failures": counts[sym], "retry_at": retry_at})
+        return retry
+
+    def retry_at(self, symbol: str) -> float | None:
+        """When `symbol` may be fetched again, or None if it is not backing off."""
+        with self._lock:
+            entry = self._negative.get(symbol)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[1]
+
+    def unpriceable(self, symbols: list[str]) -> list[str]:
+        """Symbols that have failed often enough to be reported unpriceable."""
+        with self._lock:
+            return [
+                sym
+                for sym in symbols
+                if self._negative.get(sym, (0, 0.0))[0] >= self.unpriceable_after
+            ]
+
+    def warm(self, batch_size: int = 1000) -> int:
+        """
+        Bulk-load every unexpired L2 price into L1 with one streamed query,
+        stopping at `max_entries`. Sets the readiness flag when done, even
+        on failure, so a bad warm-up degrades to a cold cache, not an
+        unready pod. Returns the number of entries loaded.
+        """
+        now = time.time()
+        query = {
+            "$or": [
+                {"expires_at": {"$gt": now}},
+                {
+                    "expires_at": {"$exists": False},
+                    "updated_at": {"$gt": now - self.ttl_seconds},
+                },
+            ]
+        }
+        projection = {
+            "_id": 0,
+            "symbol": 1,
+            "price": 1,
+            "updated_at": 1,
+            "expires_at": 1,
+        }
+        loaded = 0
+        started = time.time()
+        try:
+            cursor = self.col.find(query, projection, batch_size=batch_size)
+            chunk = []
+            for doc in cursor:
+                fetched_at, expires_at = self._doc_expiry(doc)
+                price = float(doc["price"])
+                chunk.append((doc["symbol"], price, fetched_at, expires_at))
+                full = loaded + len(chunk) >= self.max_entries
+                if len(chunk) >= batch_size or full:
+                    loaded += self._load(chunk)
+                    chunk = []
+                    if loaded >= self.max_entries:
+                        break
+            loaded += self._load(chunk)
+            elapsed = time.time() - started
+            print(f"🔥 Price cache warmed with {loaded} prices in {elapsed:.2f}s")
+        except Exception as e:
+            print(f"❌ Price cache warm-up failed: {e}")
+        finally:
+            self._warm.set()
+        return loaded
+
+    def _load(self, chunk: list[tuple[str, float, float, float]]) -> int:
+        # Prices set() while warming may still sit in the write-behind buffer,
+        # so L2 can be older than L1 here; never replace a newer entry
+        loaded = 0
+        with self._lock:
+            for sym, price, fetched_at, expires_at in chunk:
+                current = self._entries.get(sym)
+                if current is not None and current[1] >= fetched_at:
+                    continue
+                self._l1_put(sym, price, fetched_at, expires_at)
+                loaded += 1
+        return loaded
+
+    def is_warm(self) -> bool:
+        return self._warm.is_set()
+
+    def wait_warm(self, timeout: float | None = None) -> bool:
+        return self._warm.wait(timeout)
+
+    def sweep(self) -> int:
+        """Drop L1 entries past the stale window. Returns how many were removed."""
+        now = time.time()
+        with self._lock:
+            cutoff = now - self.stale_seconds
+            expired = [s for s, e in self._entries.items() if cutoff >= e[2]]
+            for sym in expired:
+                del self._entries[sym]
+            self._counters["expirations"] += len(expired)
+        return len(expired)
+
+    def flush(self):
+        """Persist pending L2 writes now."""
+        self.writes.flush()
+
+    def close(self):
+        """Flush pending L2 writes (call on shutdown)."""
+        self.writes.close()
+
+    def stats(self) -> dict:
+        writes = self.writes.stats()
+        with self._lock:
+            return {
+                **self._counters,
+                "write_behind": writes,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "negative": len(self._negative),
+                "warm": self._warm.is_set(),
+            }
+
+    # ---------- Background expiry ----------
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                n = self.sweep()
+                if n:
+                    print(f"🧹 Price cache: expired {n} entries")
+            except Exception as e:
+                print(f"❌ Price cache sweep error: {e}")
+
+    def start(self, warm: bool = True):
+        """
+        Start the background expiry and write-behind threads (idempotent),
+        and warm L1 from L2 in the background unless `warm` is False.
+        """
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep_loop, daemon=True)
+            self._sweeper.start()
+            self.writes.start()
+            if warm:
+                threading.Thread(target=self.warm, daemon=True).start()
+            else:
+                self._warm.set()
@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import CollectionInvalid
+
+# Rollup resolution -> (bucket size, retention or None to keep forever)
+ROLLUPS = {
+    "1m": (timedelta(minutes=1), timedelta(days=30)),
+    "1h": (timedelta(hours=1), timedelta(days=730)),
+    "1d": (timedelta(days=1), None),
+}
+RAW_RETENTION = timedelta(days=7)
+
+RANGES = {
+    "1d": timedelta(days=1),
+    "5d": timedelta(days=5),
+    "1mo": timedelta(days=30),
+    "3mo": timedelta(days=91),
+    "6mo": timedelta(days=182),
+    "1y": timedelta(days=365),
+    "5y": timedelta(days=5 * 365),
+    "max": None,
+}
+RESOLUTIONS = ("auto", "raw", *ROLLUPS)
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _bucket(ts: datetime, size: timedelta) -> datetime:
+    return EPOCH + ((ts - EPOCH) // size) * size
+
+
+class PriceHistory:
+    """
+    Every fetched quote is appended to the `price_ticks` time-series
+    collection (metaField = symbol) and folded into 1-minute, 1-hour and
+    daily OHLC rollups in `price_rollups_<res>`. Rollups are maintained
+    incrementally with one upsert per bucket ($setOnInsert open, $max high,
+    $min low, $set close), so queries never have to aggregate raw ticks.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.ticks = self._ticks_collection()
+        self.rollups = {res: db[f"price_rollups_{res}"] for res in ROLLUPS}
+        for res, (_, retention) in ROLLUPS.items():
+            col = self.rollups[res]
+            col.create_index(
+                [("symbol", ASCENDING), ("bucket", ASCENDING)], unique=True
+            )
+            if retention is not None:
+                col.create_index(
+                    "bucket", expireAfterSeconds=int(retention.total_seconds())
+                )
+
+    def _ticks_collection(self):
+        try:
+            self.db.create_collection(
+                "price_ticks",
+                timeseries={
+                    "timeField": "ts",
+                    "metaField": "symbol",
+                    "granularity": "minutes",
+                },
+                expireAfterSeconds=int(RAW_RETENTION.total_seconds()),
+            )
+        except CollectionInvalid:
+            pass  # already exists
+        except Exception as e:
+            # e.g. a server without time-series support; keep a plain collection
+            print(f"⚠️ price_ticks is not a time-series collection: {e}")
+        ticks = self.db["price_ticks"]
+        ticks.create_index([("symbol", ASCENDING), ("ts", ASCENDING)])
+        return ticks
+
+    def record(self, prices: dict[str, float], ts: datetime | None = None):
+        """Append one tick per symbol and update every rollup."""
+        if not prices:
+            return
+        ts = ts or datetime.utcnow()
+        self.ticks.insert_many(
+            [{"symbol": sym, "ts": ts, "price": float(p)} for sym, p in prices.items()],
+            ordered=False,
+        )
+        for res, (size, _) in ROLLUPS.items():
+            bucket = _bucket(ts, size)
+            self.rollups[res].bulk_write(
+                [
+                    UpdateOne(
+                        {"symbol": sym, "bucket": bucket},
+                        {
+                            "$setOnInsert": {"open": float(p)},
+                            "$max": {"high": float(p)},
+                            "$min": {"low": float(p)},
+                            "$set": {"close": float(p)},
+                            "$inc": {"count": 1},
+                        },
+                        upsert=True,
+                    )
+                    for sym, p in prices.items()
+                ],
+                ordered=False,
+            )
+
+    @staticmethod
+    def pick_resolution(range_: str) -> str:
+        span = RANGES[range_]
+        if span is not None and span <= timedelta(days=1):
+            return "1m"
+        if span is not None and span <= timedelta(days=30):
+            return "1h"
+        return "1d"
+
+    def query(self, symbol: str, range_: str, resolution: str) -> tuple[str, list]:
+        """
+        Return (resolution used, points) for `symbol` over `range_`.
+        Raises ValueError for an unknown range or resolution.
+        """
+        if range_ not in RANGES:
+            raise ValueError(f"range must be one of {', '.join(RANGES)}")
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+        if resolution == "auto":
+            resolution = self.pick_resolution(range_)
+
+        span = RANGES[range_]
+        since = datetime.utcnow() - span if span is not None else EPOCH
+
+        if resolution == "raw":
+            cursor = self.ticks.find(
+                {"symbol": symbol, "ts": {"$gte": since}},
+                {"_id": 0, "ts": 1, "price": 1},
+            ).sort("ts", ASCENDING)
+            return resolution, [{"ts": d["ts"], "price": d["price"]} for d in cursor]
+
+        start = _bucket(since, ROLLUPS[resolution][0])
+        cursor = self.rollups[resolution].find(
+            {"symbol": symbol, "bucket": {"$gte": start}},
+            {"_id": 0, "bucket": 1, "open": 1, "high": 1, "low": 1, "close": 1},
+        ).sort("bucket", ASCENDING)
+        return resolution, [
+            {
+                "ts": d["bucket"],
+                "open": d["open"],
+                "high": d["high"],
+                "low": d["low"],
+                "close": d["close"],
+            }
+            for d in cursor
+        ]
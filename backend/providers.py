@@ -0,0 +1,340 @@
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from typing import NamedTuple
+
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from circuit_breaker import CircuitBreaker
+from rate_limiter import PRIORITY_USER, TokenBucket
+
+
+class ProviderError(Exception):
+    """The provider call itself failed (network, quota, server error)."""
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        # Seconds the provider asked us to wait (Retry-After / quota reset)
+        self.retry_after = retry_after
+
+
+def _retry_after_seconds(value: str | None) -> float | None:
+    """Parse a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class FetchResult(NamedTuple):
+    prices: dict[str, float]
+    # Symbols a provider answered for without a price (bad/unsupported ticker)
+    rejected: list[str]
+
+
+class PriceProvider:
+    """
+    Base class for a market-data source.
+    Subclasses implement `_fetch(symbols)`, returning {symbol: price} for the
+    symbols they could price and raising ProviderError if the call as a whole
+    failed. `fetch()` adds the provider's own rate limit, a circuit breaker
+    and latency tracking.
+    """
+
+    name = "base"
+
+    def __init__(self, rate_per_min: float, max_batch: int = 1):
+        self.limiter = TokenBucket(rate_per_min)
+        self.breaker = CircuitBreaker()
+        # A batch may never need more tokens than the bucket can hold
+        self.max_batch = max(1, min(max_batch, int(self.limiter.capacity)))
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._errors = 0
+        self._throttled = 0
+        self._latency_ewma: float | None = None
+        self._latency_max = 0.0
+
+    def _fetch(self, symbols: list[str]) -> dict[str, float]:
+        raise NotImplementedError
+
+    def fetch(
+        self,
+        symbols: list[str],
+        priority: int = PRIORITY_USER,
+        max_wait: float | None = None,
+    ) -> dict[str, float]:
+        """
+        Fetch up to `max_batch` symbols. Raises ProviderError straight away
+        while the circuit breaker is open, so callers fall back to cached
+        prices instead of waiting on a degraded upstream. Otherwise waits for
+        rate-limit tokens at `priority`; if that takes longer than `max_wait`,
+        raises ProviderError so the caller can fail over.
+        """
+        if not self.breaker.allow():
+            raise ProviderError(f"{self.name} circuit is open")
+        if not self.limiter.acquire(len(symbols), priority=priority, timeout=max_wait):
+            self.breaker.cancel()
+            with self._lock:
+                self._throttled += 1
+            raise ProviderError(f"{self.name} is throttled")
+
+        started = time.monotonic()
+        try:
+            prices = self._fetch(symbols)
+            self.breaker.record_success()
+            return prices
+        except ProviderError as e:
+            self.breaker.record_failure(e.retry_after)
+            with self._lock:
+                self._errors += 1
+            raise
+        except Exception as e:
+            self.breaker.record_failure()
+            with self._lock:
+                self._errors += 1
+            raise ProviderError(f"{self.name} fetch failed: {e}") from e
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._calls += 1
+                self._latency_max = max(self._latency_max, elapsed)
+                if self._latency_ewma is None:
+                    self._latency_ewma = elapsed
+                else:
+                    self._latency_ewma = 0.8 * self._latency_ewma + 0.2 * elapsed
+
+    def stats(self) -> dict:
+        with self._lock:
+            ewma = self._latency_ewma
+            return {
+                "name": self.name,
+                "max_batch": self.max_batch,
+                "calls": self._calls,
+                "errors": self._errors,
+                "throttled": self._throttled,
+                "latency_ewma_ms": None if ewma is None else round(ewma * 1000, 1),
+                "latency_max_ms": round(self._latency_max * 1000, 1),
+                "rate_limiter": self.limiter.stats(),
+                "circuit": self.breaker.stats(),
+            }
+
+
+class TwelveDataProvider(PriceProvider):
+    """Twelve Data /price endpoint; one credit per symbol."""
+
+    name = "twelvedata"
+    URL = "https://api.twelvedata.com/price"
+
+    def __init__(
+        self,
+        api_key: str,
+        rate_per_min: float,
+        max_batch: int = 8,
+        http: httpx.Client | None = None,
+    ):
+        super().__init__(rate_per_min, max_batch)
+        self.api_key = api_key
+        self.http = http or httpx.Client(timeout=httpx.Timeout(10, connect=3))
+
+    @staticmethod
+    def _until_next_minute() -> float:
+        return 60 - time.time() % 60
+
+    @staticmethod
+    def _parse_quote(symbol: str, data) -> float | None:
+        if isinstance(data, dict) and data.get("price") is not None:
+            return float(data["price"])
+        print(f"⚠️ Twelve Data: unexpected response for {symbol}: {data}")
+        return None
+
+    def _fetch(self, symbols: list[str]) -> dict[str, float]:
+        """
+        Twelve Data answers a single symbol with {"price": ...} and several
+        with {"AAPL": {"price": ...}, "MSFT": {...}}; symbols it rejects are
+        left out.
+        """
+        if not self.api_key:
+            raise ProviderError("No Twelve Data API key configured")
+
+        params = {"symbol": ",".join(symbols), "apikey": self.api_key}
+        label = ",".join(symbols)
+
+        r = self.http.get(self.URL, params=params)
+        if r.status_code != 200:
+            retry_after = _retry_after_seconds(r.headers.get("Retry-After"))
+            if r.status_code == 429 and retry_after is None:
+                retry_after = self._until_next_minute()
+            raise ProviderError(
+                f"Twelve Data returned {r.status_code} for {label}", retry_after
+            )
+        data = r.json()
+
+        # Errors come back as HTTP 200 with {"status": "error", "code": ...};
+        # only a 4xx about a single symbol means that symbol is bad
+        if isinstance(data, dict) and data.get("status") == "error":
+            code = data.get("code")
+            if len(symbols) > 1 or code not in (400, 404):
+                # Credits are per minute, so a quota error clears next minute
+                retry_after = self._until_next_minute() if code == 429 else None
+                raise ProviderError(
+                    f"Twelve Data error {code} for {label}: {data}", retry_after
+                )
+
+        if len(symbols) == 1:
+            quotes = {symbols[0]: data}
+        else:
+            quotes = {sym: data.get(sym) for sym in symbols}
+        prices: dict[str, float] = {}
+        for sym, quote in quotes.items():
+            try:
+                p = self._parse_quote(sym, quote)
+            except (TypeError, ValueError):
+                p = None
+            if p is not None:
+                prices[sym] = p
+        print(f"✅ Twelve Data: {len(prices)}/{len(symbols)} prices for {label}")
+        return prices
+
+
+class YFinanceProvider(PriceProvider):
+    """Yahoo Finance via the `yfinance` package (unofficial, best-effort)."""
+
+    name = "yfinance"
+
+    def __init__(self, rate_per_min: float = 60, max_batch: int = 20):
+        super().__init__(rate_per_min, max_batch)
+
+    def _fetch(self, symbols: list[str]) -> dict[str, float]:
+        import yfinance as yf
+
+        tickers = yf.Tickers(" ".join(symbols))
+        prices: dict[str, float] = {}
+        for sym in symbols:
+            try:
+                p = tickers.tickers[sym].fast_info["last_price"]
+            except Exception:
+                p = None
+            if p is not None and not math.isnan(p):
+                prices[sym] = float(p)
+        print(f"✅ yfinance: {len(prices)}/{len(symbols)} prices")
+        return prices
+
+
+class LocalProvider(PriceProvider):
+    """
+    Deterministic offline provider for load tests and local development.
+    Each symbol starts at a base price (from the optional JSON file
+    {"AAPL": 190.0, ...}, otherwise derived from a hash of seed+symbol) and
+    moves once per `step_seconds`. The price at a step is a pure function of
+    (seed, symbol, step) — seeded noise layered at several time scales — so
+    every process, worker or restart with the same seed sees the same path.
+    """
+
+    name = "local"
+    # Noise layers at 1, 8, 64 and 512 steps
+    OCTAVES = 4
+
+    def __init__(
+        self,
+        seed: int = 0,
+        path: str | None = None,
+        step_seconds: float = 60,
+        volatility: float = 0.01,
+        rate_per_min: float = 1_000_000,
+        max_batch: int = 1000,
+    ):
+        super().__init__(rate_per_min, max_batch)
+        self.seed = seed
+        self.step_seconds = step_seconds
+        self.volatility = volatility
+        self.bases: dict[str, float] = {}
+        if path:
+            with open(path) as f:
+                self.bases = {k.upper(): float(v) for k, v in json.load(f).items()}
+
+    def _base(self, symbol: str) -> float:
+        if symbol in self.bases:
+            return self.bases[symbol]
+        digest = hashlib.sha256(f"{self.seed}:{symbol}".encode()).digest()
+        return 10 + int.from_bytes(digest[:4], "big") % 49000 / 100
+
+    def _noise(self, symbol: str, octave: int, i: int) -> float:
+        return random.Random(f"{self.seed}:{symbol}:{octave}:{i}").gauss(0, 1)
+
+    def price_at(self, symbol: str, step: int) -> float:
+        log_move = 0.0
+        for octave in range(self.OCTAVES):
+            scale = 8**octave
+            i, offset = divmod(step, scale)
+            a = self._noise(symbol, octave, i)
+            b = self._noise(symbol, octave, i + 1)
+            # Spread grows like sqrt(scale), as a random walk's would
+            amplitude = self.volatility * math.sqrt(scale)
+            log_move += amplitude * (a + (b - a) * offset / scale)
+        return round(self._base(symbol) * math.exp(log_move), 2)
+
+    def _fetch(self, symbols: list[str]) -> dict[str, float]:
+        step = int(time.time() // self.step_seconds)
+        return {sym: self.price_at(sym, step) for sym in symbols}
+
+
+class ProviderChain:
+    """
+    Ordered fallback chain. Symbols go to the first provider in batches of
+    its `max_batch`; whatever it could not answer (throttled, failed, or
+    rejected) moves on to the next one. A provider with a fallback behind it
+    waits at most `failover_wait_seconds` for rate-limit tokens; the last
+    provider waits as long as needed.
+    """
+
+    def __init__(self, providers: list[PriceProvider], failover_wait_seconds=2.0):
+        if not providers:
+            raise ValueError("ProviderChain needs at least one provider")
+        self.providers = providers
+        self.failover_wait_seconds = failover_wait_seconds
+
+    @property
+    def batch_size(self) -> int:
+        """Batch size of the primary provider."""
+        return self.providers[0].max_batch
+
+    def fetch(self, symbols: list[str], priority: int = PRIORITY_USER) -> FetchResult:
+        prices: dict[str, float] = {}
+        rejected: set[str] = set()
+        remaining = list(dict.fromkeys(symbols))
+        for i, provider in enumerate(self.providers):
+            if not remaining:
+                break
+            last = i == len(self.providers) - 1
+            max_wait = None if last else self.failover_wait_seconds
+            unanswered: list[str] = []
+            for start in range(0, len(remaining), provider.max_batch):
+                batch = remaining[start : start + provider.max_batch]
+                try:
+                    got = provider.fetch(batch, priority, max_wait=max_wait)
+                except ProviderError as e:
+                    print(f"❌ {e}")
+                    unanswered.extend(batch)
+                    continue
+                prices.update(got)
+                missing = [s for s in batch if s not in got]
+                rejected.update(missing)
+                unanswered.extend(missing)
+            remaining = unanswered
+        return FetchResult(prices, [s for s in remaining if s in rejected])
+
+    def stats(self) -> list[dict]:
+        return [p.stats() for p in self.providers]
@@ -0,0 +1,93 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Lower value = served first
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 10
+
+
+class TokenBucket:
+    """
+    Process-wide token bucket shared by every outbound provider call.
+    Tokens refill continuously at `rate_per_min`, up to `capacity`.
+    Waiters are served strictly by (priority, arrival), so a user-initiated
+    fetch never queues behind the background refresher.
+    """
+
+    def __init__(self, rate_per_min: float, capacity: float | None = None):
+        self.rate_per_sec = rate_per_min / 60
+        self.capacity = float(capacity if capacity is not None else rate_per_min)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiters: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._granted = 0
+        self._timeouts = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate_per_sec)
+        self._updated = now
+
+    def acquire(
+        self,
+        tokens: float = 1,
+        priority: int = PRIORITY_BACKGROUND,
+        timeout: float | None = None,
+    ) -> bool:
+        """
+        Block until `tokens` are available and this caller is first in line.
+        Returns False if `timeout` seconds pass first.
+        """
+        if tokens > self.capacity:
+            raise ValueError(
+                f"Cannot acquire {tokens} tokens (capacity {self.capacity})"
+            )
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    self._refill()
+                    at_head = self._waiters[0] == ticket
+                    if at_head and self._tokens >= tokens:
+                        self._tokens -= tokens
+                        self._granted += 1
+                        return True
+
+                    wait = None
+                    if at_head:
+                        wait = (tokens - self._tokens) / self.rate_per_sec
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            return False
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            self._refill()
+            waiting = {"user": 0, "background": 0}
+            for priority, _ in self._waiters:
+                waiting["user" if priority <= PRIORITY_USER else "background"] += 1
+            return {
+                "tokens": round(self._tokens, 2),
+                "capacity": self.capacity,
+                "fill_ratio": round(self._tokens / self.capacity, 3),
+                "rate_per_min": self.rate_per_sec * 60,
+                "waiting": waiting,
+                "granted": self._granted,
+                "timeouts": self._timeouts,
+            }
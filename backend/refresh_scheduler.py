@@ -0,0 +1,152 @@
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+
+
+class RefreshScheduler:
+    """
+    Priority queue of symbols keyed by when they next need a refresh.
+
+    A symbol is due `lead` seconds before its cached price expires, where
+    `lead` grows with the symbol's weight (number of holders and total
+    position value). Popular or large positions are therefore refreshed well
+    ahead of expiry, and when quota is short they sort ahead of the long tail
+    of one-off tickers. Symbols with no price are treated as expiring now, so
+    the heaviest of those come first too. Leads are jittered so symbols
+    fetched together do not all come due together.
+
+    With a `calendar` (ExchangeCalendar), refreshes that would come due in
+    the future while the market is closed wait for the next open instead;
+    anything already overdue still goes out, e.g. a missed closing price.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        min_lead: float = 0.05,
+        max_lead: float = 0.5,
+        jitter: float = 0.1,
+        retry_seconds: float = 300,
+        calendar=None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.min_lead = min_lead
+        self.max_lead = max_lead
+        self.jitter = jitter
+        self.retry_seconds = retry_seconds
+        self.calendar = calendar
+        self._lock = threading.Lock()
+        self._heap: list[tuple[float, int, str]] = []
+        self._due: dict[str, float] = {}
+        self._weights: dict[str, float] = {}
+        self._top_weight = 1.0  # max of _weights, kept by sync()
+        self._seq = itertools.count()
+
+    @staticmethod
+    def weight(holders: int, position_value: float) -> float:
+        """Raw weight; log-scaled so one huge position cannot dominate."""
+        return math.log1p(max(holders, 0)) + math.log1p(max(position_value, 0) / 1000)
+
+    def _lead(self, symbol: str) -> float:
+        w = self._weights.get(symbol, 0) / self._top_weight
+        lead = self.ttl_seconds * (self.min_lead + (self.max_lead - self.min_lead) * w)
+        return lead * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _push(self, symbol: str, due: float):
+        if self.calendar is not None and due > time.time():
+            due = self.calendar.next_active(due)
+        self._due[symbol] = due
+        heapq.heappush(self._heap, (due, next(self._seq), symbol))
+
+    def sync(
+        self,
+        positions: dict[str, tuple[int, float]],
+        expiries: dict[str, float | None],
+        not_before: dict[str, float] | None = None,
+    ):
+        """
+        Replace the tracked symbol set.
+        `positions` maps symbol -> (holders, total position value);
+        `expiries` maps symbol -> when its cached price expires (None if
+        there is no price); `not_before` holds symbols that are backing off
+        after failed fetches. Symbols nobody holds are dropped.
+        """
+        not_before = not_before or {}
+        now = time.time()
+        with self._lock:
+            self._weights = {
+                sym: self.weight(holders, value)
+                for sym, (holders, value) in positions.items()
+            }
+            self._top_weight = max(self._weights.values(), default=0) or 1
+            for sym in list(self._due):
+                if sym not in self._weights:
+                    del self._due[sym]
+            for sym in self._weights:
+                expires_at = expiries.get(sym) or now
+                due = max(expires_at - self._lead(sym), not_before.get(sym, 0))
+                # Keep an earlier due time (e.g. a pending retry or a bump)
+                current = self._due.get(sym)
+                if current is None or due < current:
+                    self._push(sym, due)
+            self._compact()
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [(d, n, s) for d, n, s in self._heap if self._due.get(s) == d]
+            heapq.heapify(self._heap)
+
+    def bump(self, symbols: list[str]):
+        """Make `symbols` due immediately (e.g. a user was just served stale)."""
+        now = time.time()
+        with self._lock:
+            for sym in symbols:
+                if sym in self._weights:
+                    self._push(sym, now - self._lead(sym))
+
+    def pop_due(self, limit: int) -> list[str]:
+        """Remove and return up to `limit` symbols that are due now."""
+        now = time.time()
+        out: list[str] = []
+        with self._lock:
+            while self._heap and len(out) < limit:
+                due, _, sym = self._heap[0]
+                if self._due.get(sym) != due:
+                    heapq.heappop(self._heap)  # superseded entry
+                    continue
+                if due > now:
+                    break
+                heapq.heappop(self._heap)
+                del self._due[sym]
+                out.append(sym)
+        return out
+
+    def fetched(self, symbol: str, expires_at: float):
+        """Reschedule after a successful fetch."""
+        with self._lock:
+            if symbol in self._weights:
+                self._push(symbol, expires_at - self._lead(symbol))
+
+    def failed(self, symbol: str, retry_at: float | None = None):
+        """Reschedule after a failed fetch, at `retry_at` if given."""
+        if retry_at is None:
+            retry_at = time.time() + self.retry_seconds
+        with self._lock:
+            if symbol in self._weights:
+                self._push(symbol, retry_at)
+
+    def seconds_until_next(self) -> float | None:
+        with self._lock:
+            due = min(self._due.values(), default=None)
+        return None if due is None else max(0.0, due - time.time())
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {
+                "tracked": len(self._due),
+                "due_now": sum(1 for d in self._due.values() if d <= now),
+            }
@@ -0,0 +1,69 @@
+import threading
+from typing import Any, Callable
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key.
+    The first caller runs `fn`; everyone arriving while it is in flight
+    waits and gets the same result (or exception). Nothing is cached once
+    the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+
+    def do_many(
+        self, keys: list[str], fn: Callable[[list[str]], dict[str, Any]]
+    ) -> dict[str, Any]:
+        """
+        Batch variant: `fn` receives only the keys nobody else is fetching
+        and returns a {key: result} dict. Keys already in flight are awaited.
+        Keys with no result are left out of the returned dict.
+        """
+        mine: dict[str, _Call] = {}
+        theirs: dict[str, _Call] = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                call = self._calls.get(key)
+                if call is None:
+                    mine[key] = self._calls[key] = _Call()
+                else:
+                    theirs[key] = call
+
+        results: dict[str, Any] = {}
+        if mine:
+            try:
+                out = fn(list(mine)) or {}
+                for key, call in mine.items():
+                    call.result = out.get(key)
+            except BaseException as e:
+                for call in mine.values():
+                    call.error = e
+                raise
+            finally:
+                with self._lock:
+                    for key in mine:
+                        del self._calls[key]
+                for call in mine.values():
+                    call.done.set()
+
+        for key, call in {**mine, **theirs}.items():
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            if call.result is not None:
+                results[key] = call.result
+        return results
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -1,6 +1,27 @@
 from fastapi.testclient import TestClient
-from main import app
+from circuit_breaker import CircuitBreaker
+from datetime import datetime, timedelta
+from export import ARROW_MEDIA_TYPE
+import main
+from leader_lease import MongoLease
+from market_calendar import ExchangeCalendar
+from main import app, db
+from prefetch import PrefetchQueue
+from price_cache import PriceCache, WriteBehindBuffer
+from rate_limiter import PRIORITY_BACKGROUND, PRIORITY_USER, TokenBucket
+from providers import (
+    LocalProvider,
+    PriceProvider,
+    ProviderChain,
+    ProviderError,
+    TwelveDataProvider,
+)
+from refresh_scheduler import RefreshScheduler
+import httpx
+import json
 import pytest
+import threading
+import time
 from uuid import uuid4
 
 client = TestClient(app)
@@ -36,6 +57,7 @@ def test_add_holding_and_get_holdings(user_id):
 
     add_response = client.post("/holding", json=holding)
     assert add_response.status_code == 200
+    assert add_response.json()["price_status"] in ("cached", "pending")
 
     get_response = client.get("/portfolio", params={"user_id": user_id})
     assert get_response.status_code == 200
@@ -110,3 +132,650 @@ def test_tax_calculator_estimation(user_id):
     data = response.json()
     assert "short_term" in data
     assert "long_term" in data
+
+
+def test_price_cache_is_bounded():
+    """The in-process price cache evicts least-recently-used symbols."""
+    cache = PriceCache(db["prices_cache_test"], ttl_seconds=60, max_entries=2)
+    cache.set("AAA", 1.0)
+    cache.set("BBB", 2.0)
+    assert cache.get("AAA") == 1.0  # AAA is now most recently used
+    cache.set("CCC", 3.0)
+
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["evictions"] == 1
+    # BBB was evicted from memory but is still served from Mongo (L2)
+    cache.flush()
+    assert cache.get("BBB") == 2.0
+    assert cache.stats()["l2_hits"] == 1
+
+
+def test_price_cache_warm_up(monkeypatch):
+    """warm() loads unexpired L2 prices up to max_entries, keeps newer L1 ones."""
+    col = db[f"prices_cache_warm_{uuid4().hex[:8]}"]
+    now = time.time()
+    docs = [("AAPL", 100.0, now + 60), ("MSFT", 200.0, now + 60)]
+    docs += [("NVDA", 300.0, now + 60), ("GONE", 1.0, now - 1)]
+    col.insert_many(
+        [
+            {"symbol": s, "price": p, "updated_at": now - 10, "expires_at": e}
+            for s, p, e in docs
+        ]
+    )
+
+    capped = PriceCache(col, ttl_seconds=60, max_entries=2)
+    assert capped.warm(batch_size=1) == 2
+    assert capped.stats()["size"] == 2
+
+    cache = PriceCache(col, ttl_seconds=60)
+    cache.set("AAPL", 150.0)  # still in the write-behind buffer, not in L2
+    assert cache.warm() == 2
+    assert cache.get("AAPL") == 150.0
+    assert cache.stats()["size"] == 3  # GONE had expired
+
+    class BrokenCollection:
+        def find(self, *args, **kwargs):
+            raise RuntimeError("no primary")
+
+    broken = PriceCache(BrokenCollection(), ttl_seconds=60)
+    assert broken.warm() == 0
+    assert broken.is_warm()
+
+    monkeypatch.setattr(main.price_cache, "_warm", threading.Event())
+    assert client.get("/ready").status_code == 503
+    main.price_cache._warm.set()
+    assert client.get("/ready").status_code == 200
+
+
+def test_write_behind_merges_and_retries_without_losing_newer_writes():
+    """A failed flush is re-queued underneath writes that arrived meanwhile."""
+    col = db["prices_cache_test"]
+    sym = f"W{uuid4().hex[:6].upper()}"
+
+    class FlakyCollection:
+        fail = True
+
+        def __getattr__(self, name):
+            return getattr(col, name)
+
+        def bulk_write(self, ops, ordered=True):
+            if self.fail:
+                self.fail = False
+                buffer.add(sym, {"price": 2.0})  # a newer set() mid-flush
+                raise RuntimeError("primary stepped down")
+            return col.bulk_write(ops, ordered=ordered)
+
+    buffer = WriteBehindBuffer(FlakyCollection())
+    col.update_one({"symbol": sym}, {"$set": {"failures": 3}}, upsert=True)
+    # Merged per symbol: later $set fields win, $unset survives the merge
+    buffer.add(sym, {"price": 1.0, "updated_at": 10.0}, unset={"failures"})
+    buffer.add(sym, {"updated_at": 11.0})
+
+    assert buffer.flush() == 0
+    assert buffer.stats()["errors"] == 1 and buffer.stats()["pending"] == 1
+    assert buffer.flush() == 1
+
+    doc = col.find_one({"symbol": sym})
+    assert doc["price"] == 2.0 and doc["updated_at"] == 11.0
+    assert "failures" not in doc
+
+
+def test_price_cache_serves_stale_and_queues_refresh():
+    """Expired prices are still served, flagged stale, and queued for refresh."""
+    queued = []
+    cache = PriceCache(
+        db["prices_cache_test"],
+        ttl_seconds=60,
+        stale_seconds=3600,
+        on_stale=queued.extend,
+    )
+    cache.set("OLD", 42.0, ttl=-1)  # already past its TTL
+
+    assert cache.get("OLD") is None
+    quote = cache.lookup_many(["OLD"])["OLD"]
+    assert quote.price == 42.0
+    assert quote.is_stale
+    assert queued == ["OLD"]
+
+
+def test_prefetch_queue_batches_and_recovers():
+    """Duplicates collapse, batches are capped, failures don't wedge symbols."""
+    calls = []
+
+    def fetch(batch):
+        calls.append(batch)
+        raise RuntimeError("provider down")
+
+    queue = PrefetchQueue(fetch, batch_size=2, linger_seconds=0)
+    for sym in ("AAA", "AAA", "BBB", "CCC", "BBB"):
+        queue.enqueue(sym)
+    assert queue.stats()["queued"] == 3
+
+    queue.start()
+    deadline = time.time() + 5
+    while queue.stats()["failed"] < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    assert calls == [["AAA", "BBB"], ["CCC"]]
+    assert queue.stats()["in_progress"] == 0
+    assert not queue.is_pending("AAA")
+
+
+def test_add_holding_never_fetches_inline(user_id, monkeypatch):
+    """POST /holding queues unknown symbols instead of calling the provider."""
+    fetched, queued = [], []
+    monkeypatch.setattr(main.price_providers, "fetch", fetched.append)
+    monkeypatch.setattr(main.prefetch_queue, "enqueue", queued.append)
+    sym = f"P{uuid4().hex[:6].upper()}"
+
+    holding = {"user_id": user_id, "symbol": sym, "qty": 1, "price": 1.0}
+    resp = client.post("/holding", json=holding)
+    assert resp.status_code == 200
+    assert resp.json()["price_status"] == "pending"
+    assert queued == [sym] and fetched == []
+
+
+def test_concurrent_fetch_price_is_coalesced(monkeypatch):
+    """50 threads asking for one symbol make a single outbound request."""
+    calls = []
+    gate = threading.Barrier(50)
+
+    class SlowProvider(PriceProvider):
+        name = "slow"
+
+        def _fetch(self, symbols):
+            calls.append(symbols)
+            time.sleep(0.2)  # keep the request in flight while others arrive
+            return {s: 123.45 for s in symbols}
+
+    chain = ProviderChain([SlowProvider(rate_per_min=6000, max_batch=8)])
+    monkeypatch.setattr(main, "price_providers", chain)
+
+    results = []
+
+    def worker():
+        gate.wait()
+        results.append(main.fetch_price("COAL"))
+
+    threads = [threading.Thread(target=worker) for _ in range(50)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == [["COAL"]]
+    assert results == [123.45] * 50
+
+
+def test_token_bucket_serves_user_before_background():
+    """A user waiter overtakes a background waiter already at the head."""
+    bucket = TokenBucket(rate_per_min=600, capacity=1)  # one token per 0.1 s
+    assert bucket.acquire(1)  # drain it
+    order = []
+
+    def waiter(name, priority):
+        bucket.acquire(1, priority=priority)
+        order.append(name)
+
+    background = threading.Thread(target=waiter, args=("bg", PRIORITY_BACKGROUND))
+    background.start()
+    time.sleep(0.02)  # background is now first in line
+    user = threading.Thread(target=waiter, args=("user", PRIORITY_USER))
+    user.start()
+    background.join()
+    user.join()
+    assert order == ["user", "bg"]
+
+
+def test_token_bucket_times_out():
+    """A waiter that can't get tokens in time gives up and leaves the queue."""
+    bucket = TokenBucket(rate_per_min=6, capacity=1)  # one token per 10 s
+    assert bucket.acquire(1)
+    started = time.monotonic()
+    assert not bucket.acquire(1, timeout=0.1)
+    assert time.monotonic() - started < 1
+    stats = bucket.stats()
+    assert stats["timeouts"] == 1
+    assert stats["waiting"] == {"user": 0, "background": 0}
+
+
+def test_refresh_scheduler_prioritises_heavy_symbols():
+    """Widely held / large positions are refreshed before the long tail."""
+    scheduler = RefreshScheduler(ttl_seconds=3600)
+    scheduler.sync(
+        {"TAIL": (1, 500.0), "BIG": (40, 2_000_000.0), "MID": (3, 20_000.0)},
+        {},
+    )
+    assert scheduler.pop_due(3) == ["BIG", "MID", "TAIL"]
+
+    # Freshly fetched symbols are not due again until shortly before expiry
+    scheduler.fetched("BIG", time.time() + 3600)
+    assert scheduler.pop_due(3) == []
+
+
+def test_lease_renews_expires_and_is_taken_over():
+    """One holder at a time; a lapsed lease passes to the next contender."""
+    name = f"lease_{uuid4().hex[:8]}"
+    a = MongoLease(db["leases_test"], name, ttl_seconds=0.3)
+    b = MongoLease(db["leases_test"], name, ttl_seconds=0.3)
+
+    assert a.try_acquire() and a.is_leader()
+    assert not b.try_acquire() and not b.is_leader()
+    time.sleep(0.2)
+    assert a.try_acquire()  # renewal pushes the expiry out
+    time.sleep(0.2)
+    assert not b.try_acquire()
+
+    time.sleep(0.2)  # a stops renewing and the lease lapses
+    assert b.try_acquire() and b.is_leader()
+    assert not a.try_acquire() and not a.is_leader()
+
+
+def test_lease_release_hands_over_immediately():
+    """release() frees the lease without waiting for it to expire."""
+    name = f"lease_{uuid4().hex[:8]}"
+    a = MongoLease(db["leases_test"], name, ttl_seconds=60)
+    b = MongoLease(db["leases_test"], name, ttl_seconds=60)
+    assert a.try_acquire()
+    assert not b.try_acquire()
+
+    a.release()
+    assert not a.is_leader()
+    assert b.try_acquire() and b.is_leader()
+
+
+def test_failed_symbols_back_off_and_become_unpriceable():
+    """Repeated failures double the retry delay and mark a symbol unpriceable."""
+    cache = PriceCache(
+        db["prices_cache_test"],
+        ttl_seconds=60,
+        retry_base_seconds=100,
+        unpriceable_after=3,
+    )
+    delays = []
+    for _ in range(3):
+        assert cache.unpriceable(["NOPE"]) == []
+        delays.append(cache.mark_failed(["NOPE"])["NOPE"] - time.time())
+
+    assert cache.retry_at("NOPE") is not None
+    assert cache.unpriceable(["NOPE"]) == ["NOPE"]
+    assert 80 < delays[0] < 120 and 160 < delays[1] < 240 and 320 < delays[2] < 480
+
+    # A successful fetch clears the negative entry
+    cache.set("NOPE", 1.0)
+    assert cache.retry_at("NOPE") is None
+    assert cache.unpriceable(["NOPE"]) == []
+
+
+def test_symbol_registry_tracks_holders(user_id):
+    """Holding writes keep the symbols registry's reference counts current."""
+    sym = f"R{uuid4().hex[:6].upper()}"
+    client.post(
+        "/holding", json={"user_id": user_id, "symbol": sym, "qty": 4, "price": 10.0}
+    )
+    doc = main.symbols_col.find_one({"_id": sym})
+    assert doc["holders"] == 1 and doc["qty"] == 4 and doc["cost"] == 40.0
+
+    client.post(f"/holding/{sym}/sell", json={"user_id": user_id, "qty": 1})
+    assert main.symbols_col.find_one({"_id": sym})["qty"] == 3
+
+    client.delete(f"/holding/{sym}", params={"user_id": user_id})
+    assert main.symbols_col.find_one({"_id": sym}) is None
+
+
+def test_stale_symbols_are_forwarded_to_the_leader(user_id):
+    """Non-leaders hand stale symbols to the leader through the registry."""
+    sym = f"F{uuid4().hex[:6].upper()}"
+    holding = {"user_id": user_id, "symbol": sym, "qty": 1, "price": 10.0}
+    client.post("/holding", json=holding)
+
+    main.queue_price_refresh([sym])
+    main._forward_refresh_requests(main._drain_refresh_queue())
+    assert "refresh_requested_at" in main.symbols_col.find_one({"_id": sym})
+
+    assert sym in main._claim_refresh_requests()
+    assert sym not in main._claim_refresh_requests()
+    assert main.symbols_col.find_one({"_id": sym})["holders"] == 1
+
+
+def test_provider_chain_fails_over_to_local_provider():
+    """A throttled or failing primary falls back to the next provider."""
+
+    class DownProvider(PriceProvider):
+        name = "down"
+
+        def _fetch(self, symbols):
+            raise RuntimeError("503 Service Unavailable")
+
+    local, twin = LocalProvider(seed=7), LocalProvider(seed=7)
+    chain = ProviderChain([DownProvider(rate_per_min=60, max_batch=5), local])
+    prices, rejected = chain.fetch(["AAPL", "MSFT"])
+
+    assert set(prices) == {"AAPL", "MSFT"} and rejected == []
+    # Same seed, same prices: the local provider is deterministic
+    assert twin.fetch(["AAPL", "MSFT"]) == prices
+    assert chain.stats()[0]["errors"] == 1
+
+
+def test_twelvedata_parses_batches_and_errors():
+    """Single and keyed responses, per-symbol errors, and call-level errors."""
+    error = {"status": "error", "code": 400, "message": "symbol not found"}
+    responses = {
+        "AAPL": {"price": "190.5"},
+        "AAPL,BAD,MSFT": {"AAPL": {"price": "190.5"}, "BAD": error, "MSFT": {}},
+        "BAD": error,
+        "AAPL,NVDA": error,
+        "QUOTA": {"status": "error", "code": 429, "message": "out of credits"},
+    }
+
+    def handler(request):
+        symbols = request.url.params["symbol"]
+        if symbols == "LIMIT":
+            return httpx.Response(429, headers={"Retry-After": "7"})
+        return httpx.Response(200, json=responses[symbols])
+
+    http = httpx.Client(transport=httpx.MockTransport(handler))
+    provider = TwelveDataProvider("key", rate_per_min=600, http=http)
+
+    assert provider._fetch(["AAPL"]) == {"AAPL": 190.5}
+    # Only entries that carry a price come back; error and empty ones don't
+    assert provider._fetch(["AAPL", "BAD", "MSFT"]) == {"AAPL": 190.5}
+    prices, rejected = ProviderChain([provider]).fetch(["BAD"])
+    assert prices == {} and rejected == ["BAD"]
+
+    # A 4xx for a whole batch says nothing about any one symbol
+    with pytest.raises(ProviderError):
+        provider._fetch(["AAPL", "NVDA"])
+    with pytest.raises(ProviderError) as quota:
+        provider._fetch(["QUOTA"])
+    assert 0 < quota.value.retry_after <= 60
+
+    with pytest.raises(ProviderError) as limited:
+        provider.fetch(["LIMIT"])
+    assert limited.value.retry_after == 7
+    assert provider.breaker.stats()["state"] == "open"
+    assert provider.breaker.stats()["retry_in"] > 5
+
+
+def test_local_provider_is_independent_of_start_time(monkeypatch):
+    """Instances built at different times (other workers, restarts) agree."""
+    early = LocalProvider(seed=7)
+    monkeypatch.setattr(time, "time", lambda: 1_700_000_000 + 30 * 60)
+    late = LocalProvider(seed=7)
+    assert early.fetch(["AAPL"]) == late.fetch(["AAPL"])
+
+    step = 1_700_000_000 // 60
+    path = [early.price_at("AAPL", step + i) for i in range(50)]
+    assert path == [late.price_at("AAPL", step + i) for i in range(50)]
+    # Moves from step to step, but only a little
+    assert len(set(path)) > 1
+    assert all(abs(b / a - 1) < 0.1 for a, b in zip(path, path[1:]))
+
+
+def test_circuit_breaker_opens_on_retry_after_and_probes():
+    """A 429 with Retry-After opens the breaker; one probe closes it again."""
+    breaker = CircuitBreaker(failure_threshold=3, base_cooldown=0.01)
+    assert breaker.allow()
+    breaker.record_failure(retry_after=0.2)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.25)
+    assert breaker.allow()  # the half-open probe
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_price_history_rollups():
+    """Fetched ticks are rolled up into OHLC buckets served by the endpoint."""
+    sym = f"H{uuid4().hex[:6].upper()}"
+    base = datetime.utcnow().replace(second=0, microsecond=0)
+    for i, p in enumerate([10.0, 12.0, 9.0, 11.0]):
+        main.price_history.record({sym: p}, base + timedelta(seconds=10 * i))
+
+    resp = client.get(f"/prices/{sym}/history", params={"range": "1d"})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["resolution"] == "1m"
+    assert len(body["points"]) == 1
+    point = body["points"][0]
+    assert (point["open"], point["high"], point["low"], point["close"]) == (
+        10.0,
+        12.0,
+        9.0,
+        11.0,
+    )
+
+    bad = client.get(f"/prices/{sym}/history", params={"range": "2w"})
+    assert bad.status_code == 400
+
+
+def test_market_calendar_ttl():
+    """Prices last until the next open when closed and are tight in-session."""
+    cal = ExchangeCalendar(open_ttl=900, settle_seconds=600)
+
+    def ts(day, hh, mm):
+        return datetime(*day, hh, mm, tzinfo=cal.tz).timestamp()
+
+    monday_open = ts((2026, 1, 12), 9, 30)
+    # Friday after the settle window -> valid until Monday's open
+    assert cal.expires_at(ts((2026, 1, 9), 17, 0)) == monday_open
+    # In session -> open TTL, but never past close + settle
+    assert cal.expires_at(ts((2026, 1, 12), 11, 0)) == ts((2026, 1, 12), 11, 15)
+    assert cal.expires_at(ts((2026, 1, 12), 15, 55)) == ts((2026, 1, 12), 16, 10)
+    # Holiday (MLK day) and early close from the shipped table
+    assert cal.next_open(ts((2026, 1, 16), 17, 0)) == ts((2026, 1, 20), 9, 30)
+    assert not cal.is_open(ts((2026, 11, 27), 13, 30))
+
+    # Refreshes due while closed wait for the open; the settle window counts
+    assert cal.next_active(ts((2026, 1, 10), 12, 0)) == monday_open
+    assert cal.next_active(ts((2026, 1, 12), 16, 5)) == ts((2026, 1, 12), 16, 5)
+
+
+def test_portfolio_realized_total(user_id):
+    """Realized profit is summed across every sale, partial or full."""
+    before = client.get("/portfolio", params={"user_id": user_id}).json()
+    holding = {"user_id": user_id, "symbol": "MSFT", "qty": 10, "price": 100.0}
+    assert client.post("/holding", json=holding).status_code == 200
+    for qty, price in [(4, 110.0), (6, 95.0)]:
+        resp = client.post(
+            "/holding/MSFT/sell",
+            json={"user_id": user_id, "qty": qty, "price": price},
+        )
+        assert resp.status_code == 200
+
+    after = client.get("/portfolio", params={"user_id": user_id}).json()
+    assert after["realized_profit"] == pytest.approx(before["realized_profit"] + 10)
+    assert all(h["symbol"] != "MSFT" for h in after["holdings"])
+
+    stats = client.get("/portfolio_stats", params={"user_id": user_id}).json()
+    assert stats["realized_by_symbol"]["MSFT"] == pytest.approx(10)
+    assert stats["realized_profit"] == pytest.approx(after["realized_profit"])
+
+    # Deleting a sale backs it out; a rebuild from realized_gains agrees
+    sales = client.get("/sales_history", params={"user_id": user_id}).json()
+    sale = next(s for s in sales["sales"] if s["symbol"] == "MSFT")
+    resp = client.delete(f"/sales_history/{sale['id']}", params={"user_id": user_id})
+    assert resp.status_code == 200
+    stats = client.get("/portfolio_stats", params={"user_id": user_id}).json()
+    assert stats["sales"] == len(sales["sales"]) - 1
+    main.rebuild_portfolio_stats(main._objid(user_id))
+    rebuilt = client.get("/portfolio_stats", params={"user_id": user_id}).json()
+    assert rebuilt["realized_profit"] == pytest.approx(stats["realized_profit"])
+    assert rebuilt["sales"] == stats["sales"]
+
+
+def test_sales_history_pagination(user_id):
+    """Keyset pages cover every sale exactly once, newest first."""
+    holding = {"user_id": user_id, "symbol": "XPAG", "qty": 5, "price": 10.0}
+    assert client.post("/holding", json=holding).status_code == 200
+    for _ in range(5):
+        resp = client.post(
+            "/holding/XPAG/sell", json={"user_id": user_id, "qty": 1, "price": 11.0}
+        )
+        assert resp.status_code == 200
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"user_id": user_id, "symbol": "xpag", "limit": 2}
+        if cursor:
+            params["after"] = cursor
+        body = client.get("/sales_history", params=params).json()
+        seen.extend(body["sales"])
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == 3
+    assert len({s["id"] for s in seen}) == 5
+    assert [s["timestamp"] for s in seen] == sorted(
+        (s["timestamp"] for s in seen), reverse=True
+    )
+
+    yesterday = (datetime.utcnow() - timedelta(days=1)).date().isoformat()
+    params = {"user_id": user_id, "symbol": "XPAG", "end": yesterday}
+    assert client.get("/sales_history", params=params).json()["sales"] == []
+    bad = client.get("/sales_history", params={"user_id": user_id, "after": "nope"})
+    assert bad.status_code == 400
+
+
+def test_export_streams(user_id):
+    """Exports stream every row in the requested format."""
+    holding = {"user_id": user_id, "symbol": "XEXP", "qty": 3, "price": 5.0}
+    assert client.post("/holding", json=holding).status_code == 200
+    sale = {"user_id": user_id, "qty": 1, "price": 6.0}
+    assert client.post("/holding/XEXP/sell", json=sale).status_code == 200
+
+    params = {"user_id": user_id}
+    resp = client.get("/export/sales", params=params)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert {"id", "symbol", "profit", "timestamp"} <= set(rows[0])
+    assert any(r["symbol"] == "XEXP" and r["profit"] == 1.0 for r in rows)
+
+    resp = client.get("/export/holdings", params={"user_id": user_id, "format": "csv"})
+    assert resp.status_code == 200
+    lines = resp.text.splitlines()
+    assert lines[0] == "symbol,qty,avg_price,current_price,as_of"
+    assert any(line.startswith("XEXP,2.0,5.0") for line in lines[1:])
+
+    bad = client.get("/export/sales", params={"user_id": user_id, "format": "xml"})
+    assert bad.status_code == 400
+
+
+def test_columnar_responses(user_id):
+    """Arrow via Accept on the dashboard endpoints, Parquet for downloads."""
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    holding = {"user_id": user_id, "symbol": "XCOL", "qty": 2, "price": 5.0}
+    assert client.post("/holding", json=holding).status_code == 200
+    sale = {"user_id": user_id, "qty": 1, "price": 6.0}
+    assert client.post("/holding/XCOL/sell", json=sale).status_code == 200
+
+    resp = client.get(
+        "/portfolio",
+        params={"user_id": user_id},
+        headers={"Accept": "application/vnd.apache.arrow.stream"},
+    )
+    assert resp.status_code == 200
+    table = pa.ipc.open_stream(resp.content).read_all()
+    assert "XCOL" in table.column("symbol").to_pylist()
+    assert table.schema.field("as_of").type == pa.timestamp("ms")
+    json_body = client.get("/portfolio", params={"user_id": user_id}).json()
+    realized = json.loads(table.schema.metadata[b"realized_profit"])
+    assert realized == pytest.approx(json_body["realized_profit"])
+
+    params = {"user_id": user_id, "format": "parquet"}
+    resp = client.get("/export/sales", params=params)
+    assert resp.status_code == 200
+    sales = pq.read_table(pa.BufferReader(resp.content))
+    page = client.get("/sales_history", params=params).json()
+    assert sales.num_rows == len(page["sales"])
+    assert "XCOL" in sales.column("symbol").to_pylist()
+
+    params = {"user_id": user_id}
+    refused = f"{ARROW_MEDIA_TYPE};q=0, application/json"
+    for accept in (refused, f"application/json, {ARROW_MEDIA_TYPE};q=0.5"):
+        resp = client.get("/portfolio", params=params, headers={"Accept": accept})
+        assert resp.headers["content-type"].startswith("application/json")
+    preferred = f"application/json;q=0.5, {ARROW_MEDIA_TYPE}"
+    resp = client.get("/portfolio", params=params, headers={"Accept": preferred})
+    assert resp.headers["content-type"] == ARROW_MEDIA_TYPE
+
+
+def test_conditional_get(user_id):
+    """Unchanged data answers 304; holding, sale and price writes change the ETag."""
+    params = {"user_id": user_id}
+    first = client.get("/portfolio", params=params)
+    etag = first.headers["etag"]
+    again = client.get("/portfolio", params=params, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+
+    assert etag.startswith('W/"')
+    sales_etag = client.get("/sales_history", params=params).headers["etag"]
+    sales = client.get(
+        "/sales_history", params=params, headers={"If-None-Match": sales_etag}
+    )
+    assert sales.status_code == 304
+    arrow = {"Accept": "application/vnd.apache.arrow.stream", "If-None-Match": etag}
+    assert client.get("/portfolio", params=params, headers=arrow).status_code == 200
+
+    holding = {"user_id": user_id, "symbol": "XETG", "qty": 1, "price": 1.0}
+    client.post("/holding", json=holding)
+    changed = client.get("/portfolio", params=params, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    etag = changed.headers["etag"]
+
+    main.price_cache.set("XETG", 2.0)
+    resp = client.get("/portfolio", params=params, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    etag = resp.headers["etag"]
+    main.price_cache.set("XETG", 3.0)
+    resp = client.get("/portfolio", params=params, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+
+
+def test_compressed_json(user_id):
+    """Large bodies are compressed; ts fields keep their ISO-8601 format."""
+    # Each sale serializes to well over 100 bytes
+    count = main.COMPRESS_MIN_BYTES // 100 + 1
+    holding = {"user_id": user_id, "symbol": "XBRO", "qty": count, "price": 5.0}
+    assert client.post("/holding", json=holding).status_code == 200
+    sale = {"user_id": user_id, "qty": 1, "price": 6.0}
+    for _ in range(count):
+        assert client.post("/holding/XBRO/sell", json=sale).status_code == 200
+
+    params = {"user_id": user_id, "symbol": "XBRO"}
+    headers = {"Accept-Encoding": "br"}
+    resp = client.get("/sales_history", params=params, headers=headers)
+    assert resp.status_code == 200
+    assert resp.headers["content-encoding"] == "br"
+    sale = resp.json()["sales"][0]
+    assert datetime.fromisoformat(sale["timestamp"])
+
+    resp = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in resp.headers  # below the size threshold
+
+
+def test_add_holding_reports_backing_off_symbols(user_id):
+    """Symbols in backoff are not queued and say so instead of "pending"."""
+    sym = f"B{uuid4().hex[:6].upper()}"
+    holding = {"user_id": user_id, "symbol": sym, "qty": 1, "price": 1.0}
+
+    main.price_cache.mark_failed([sym])
+    body = client.post("/holding", json=holding).json()
+    assert body["price_status"] == "retrying" and body["retry_at"]
+    assert not main.prefetch_queue.is_pending(sym)
+
+    main.price_cache.mark_failed([sym])
+    main.price_cache.mark_failed([sym])
+    assert client.post("/holding", json=holding).json()["price_status"] == "unpriceable"
+    client.delete(f"/holding/{sym}", params={"user_id": user_id})
+
+
+def test_collectr_value_parsing():
+    """The Collectr page parser (run off the event loop) finds the value."""
+    html = "<div><span>Collection value: $1,234.50 Collection</span></div>"
+    assert main._parse_collectr_value(html) == 1234.5
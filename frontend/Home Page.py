@@ -4,6 +4,7 @@ import time
 import requests
 import pandas as pd
 import plotly.express as px
+import pyarrow as pa
 import streamlit as st
 
 
@@ -18,11 +19,46 @@ SESSION_FILE = ".session.json"
 # ----------------------------
 # HELPERS
 # ----------------------------
-def api_get(path: str, params: dict | None = None, timeout: int = 10):
+API_CACHE_SIZE = 16
+
+def api_get(path: str, params: dict | None = None, timeout: int = 10, headers: dict | None = None):
+    """
+    GET with a small per-session cache of validated responses: the last ETag
+    for a URL is sent as If-None-Match, and a 304 reuses the cached response,
+    so Streamlit reruns don't refetch unchanged data.
+    """
     url = f"{BACKEND_URL}{path}"
-    r = requests.get(url, params=params, timeout=timeout)
+    headers = dict(headers or {})
+    cache = st.session_state.setdefault("api_cache", {})
+    key = (url, tuple(sorted((params or {}).items())), headers.get("Accept"))
+    cached = cache.get(key)
+    if cached is not None:
+        headers["If-None-Match"] = cached.headers["ETag"]
+    r = requests.get(url, params=params, timeout=timeout, headers=headers)
+    if r.status_code == 304 and cached is not None:
+        cache[key] = cache.pop(key)  # most recently used goes last
+        return cached
+    cache.pop(key, None)
+    if r.status_code == 200 and r.headers.get("ETag"):
+        cache[key] = r
+        while len(cache) > API_CACHE_SIZE:
+            cache.pop(next(iter(cache)))
     return r
 
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+def api_get_frame(path: str, params: dict | None = None, timeout: int = 10):
+    """
+    GET a tabular endpoint as Arrow IPC and load it straight into pandas.
+    Returns (response, DataFrame, metadata dict); the frame is None on errors.
+    """
+    r = api_get(path, params=params, timeout=timeout, headers={"Accept": ARROW_MEDIA_TYPE})
+    if r.status_code != 200 or not r.headers.get("content-type", "").startswith(ARROW_MEDIA_TYPE):
+        return r, None, {}
+    table = pa.ipc.open_stream(r.content).read_all()
+    meta = {k.decode(): json.loads(v) for k, v in (table.schema.metadata or {}).items()}
+    return r, table.to_pandas(), meta
+
 def api_post(path: str, json_body: dict | None = None, timeout: int = 10):
     url = f"{BACKEND_URL}{path}"
     r = requests.post(url, json=json_body, timeout=timeout)
@@ -143,31 +179,36 @@ if st.sidebar.button("Logout"):
 st.title(f"📊 Welcome back, {st.session_state.username}!")
 st.subheader("Your Portfolio Overview")
 
-portfolio_data = {}
+df = pd.DataFrame()
+realized_profit = 0
 try:
-    resp = api_get("/portfolio", params={"user_id": st.session_state.user_id}, timeout=20)
-    if resp.status_code == 200:
+    resp, df, meta = api_get_frame("/portfolio", params={"user_id": st.session_state.user_id}, timeout=20)
+    if df is not None:
+        realized_profit = meta.get("realized_profit", 0) or 0
+    elif resp.status_code == 200:
         portfolio_data = resp.json()
+        df = pd.DataFrame(portfolio_data.get("holdings", []) or [])
+        realized_profit = portfolio_data.get("realized_profit", 0) or 0
     else:
+        df = pd.DataFrame()
         st.error(f"⚠️ Could not fetch portfolio ({resp.status_code}) — {resp.text}")
 except Exception as e:
+    df = pd.DataFrame()
     st.error(f"❌ Backend not reachable: {e}")
 
-holdings = portfolio_data.get("holdings", []) or []
-realized_profit = portfolio_data.get("realized_profit", 0) or 0
-
-if not holdings:
+if df.empty:
     st.warning("No holdings yet.")
     st.stop()
 
-df = pd.DataFrame(holdings)
-expected_cols = ["symbol","qty","avg_price","current_price","value","unrealized_profit","warning"]
+expected_cols = ["symbol","qty","avg_price","current_price","value","unrealized_profit","is_stale","as_of","warning"]
 for c in expected_cols:
     if c not in df.columns:
         df[c] = None
 
+# Arrow frames arrive typed already; only the JSON fallback needs coercion
 for col in ["qty","avg_price","current_price","value","unrealized_profit"]:
-    df[col] = pd.to_numeric(df[col], errors="coerce")
+    if not pd.api.types.is_float_dtype(df[col]):
+        df[col] = pd.to_numeric(df[col], errors="coerce")
 
 # ----------------------------
 # Summary Metrics
@@ -176,6 +217,14 @@ total_value = float(df["value"].fillna(0).sum())
 unrealized = float(df["unrealized_profit"].fillna(0).sum())
 total_profit = unrealized + float(realized_profit or 0)
 
+stale_syms = df.loc[df["is_stale"].fillna(False).astype(bool), "symbol"].tolist()
+if stale_syms:
+    st.caption(f"⏳ Showing last known prices for {', '.join(stale_syms)} — refreshing in the background.")
+
+bad_syms = df.loc[df["warning"] == "unpriceable", "symbol"].tolist()
+if bad_syms:
+    st.caption(f"🚫 No market price available for {', '.join(bad_syms)} — check the ticker symbol.")
+
 col1, col2, col3 = st.columns(3)
 with col1:
     st.metric("Total Portfolio Value", money(total_value))
@@ -304,6 +353,11 @@ with left:
                     r = api_post("/holding", payload, timeout=10)
                     if r.status_code == 200:
                         st.success(f"✅ Holding saved: {symbol_in} ({qty_in} @ {price_in:.2f})")
+                        price_status = r.json().get("price_status")
+                        if price_status == "unpriceable":
+                            st.warning(f"No market price could be found for {symbol_in}; check the ticker.")
+                        elif price_status == "retrying":
+                            st.info(f"Price lookup for {symbol_in} failed recently; it will be retried later.")
                         time.sleep(0.6)
                         st.rerun()
                     else:
@@ -313,9 +367,9 @@ with left:
 
 with right:
     with st.expander("💵 Sell a Holding"):
-        if isinstance(holdings, list) and len(holdings) > 0:
+        if not df.empty:
             with st.form("sell_holding_form"):
-                symbols_opts = [h["symbol"] for h in holdings if "symbol" in h]
+                symbols_opts = df["symbol"].dropna().tolist()
                 symbol_sel = st.selectbox("Select Holding to Sell", symbols_opts)
                 qty_sell = st.number_input("Quantity to Sell", min_value=0.0, step=1.0, value=0.0)
                 price_input = st.number_input("Sell Price (leave 0 to use market)", min_value=0.0, step=0.01, value=0.0)
@@ -345,13 +399,39 @@ with right:
 st.markdown("---")
 st.subheader("📜 Sale History")
 
+SALES_PAGE_SIZE = 50
+
+f1, f2 = st.columns([1, 2])
+with f1:
+    sales_symbol = st.text_input("Filter by symbol", key="sales_symbol").strip().upper()
+with f2:
+    sales_dates = st.date_input("Date range", value=(), key="sales_dates")
+
+# Cursors of the pages we came through, so "Newer" can go back; reset on filter change
+sales_filters = (sales_symbol, tuple(sales_dates))
+if st.session_state.get("sales_filters") != sales_filters:
+    st.session_state.sales_filters = sales_filters
+    st.session_state.sales_cursors = [None]
+
+sales_params = {"user_id": st.session_state.user_id, "limit": SALES_PAGE_SIZE}
+if sales_symbol:
+    sales_params["symbol"] = sales_symbol
+if len(sales_dates) == 2:
+    sales_params["start"] = sales_dates[0].isoformat()
+    sales_params["end"] = sales_dates[1].isoformat()
+if st.session_state.sales_cursors[-1]:
+    sales_params["after"] = st.session_state.sales_cursors[-1]
+
 try:
-    r = api_get("/sales_history", params={"user_id": st.session_state.user_id}, timeout=10)
-    if r.status_code == 200:
-        sales_data = r.json().get("sales", [])
-        if sales_data:
-            sales_df = pd.DataFrame(sales_data)
+    r, sales_df, sales_meta = api_get_frame("/sales_history", params=sales_params, timeout=10)
+    if sales_df is None and r.status_code == 200:
+        sales_df = pd.DataFrame(r.json().get("sales", []))
+        sales_meta = {"next_cursor": r.json().get("next_cursor")}
+        if not sales_df.empty:
             sales_df["timestamp"] = pd.to_datetime(sales_df["timestamp"])
+    if sales_df is not None:
+        next_cursor = sales_meta.get("next_cursor")
+        if not sales_df.empty:
             sales_df["profit_display"] = sales_df["profit"].apply(
                 lambda x: f"${x:,.2f}" if x >= 0 else f"-${abs(x):,.2f}"
             )
@@ -379,6 +459,19 @@ try:
                         }).to_html(escape=False, index=False) +
                         '</div>', unsafe_allow_html=True)
 
+            # Pagination
+            p1, p2, p3 = st.columns([1, 1, 4])
+            with p1:
+                if len(st.session_state.sales_cursors) > 1 and st.button("◀ Newer"):
+                    st.session_state.sales_cursors.pop()
+                    st.rerun()
+            with p2:
+                if next_cursor and st.button("Older ▶"):
+                    st.session_state.sales_cursors.append(next_cursor)
+                    st.rerun()
+            with p3:
+                st.caption(f"Page {len(st.session_state.sales_cursors)}")
+
             # Delete control
             sale_to_delete = st.selectbox(
                 "Select a sale to delete (if entered by mistake):",
@@ -23,7 +23,7 @@ st.caption("Estimate after-tax returns by combining your realized gains with you
 # ----------------------------
 realized_gains = 0.0
 try:
-    r = requests.get(f"{BACKEND_URL}/portfolio", params={"user_id": st.session_state.user_id}, timeout=10)
+    r = requests.get(f"{BACKEND_URL}/portfolio_stats", params={"user_id": st.session_state.user_id}, timeout=10)
     if r.status_code == 200:
         data = r.json()
         realized_gains = float(data.get("realized_profit", 0) or 0)